@@ -0,0 +1,264 @@
+"""Двухуровневый кеш: локальный LRU процесса перед общим бэкендом.
+
+L1 - маленький словарь в памяти воркера с коротким сроком жизни,
+L2 - общий для всех воркеров кеш (memcached, Redis, файлы), алиас
+которого задаётся в LOCATION. Запись идёт в оба уровня, чтение -
+сначала из L1.
+
+Другие воркеры не видят удалений из чужого L1, поэтому ключи
+поколений (posts.cache) и прочие ключи с префиксами из L1_BYPASS
+читаются только из L2: сдвиг поколения сразу виден всем воркерам,
+а всё, что от него зависит, уходит на новые ключи.
+
+Настройки - CACHES в yatube/settings.py.
+
+get_or_refresh защищает горячие ключи от лавины промахов: значение
+пересчитывает один воркер, остальные тем временем отдают старое.
+"""
+import math
+import pickle
+import random
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import cache, caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.utils.functional import cached_property
+
+# Размер и срок жизни L1 по умолчанию
+L1_MAX_ENTRIES = 1000
+L1_TIMEOUT = 5
+
+# Сколько после срока ещё можно отдавать старое значение, пока
+# его пересчитывает другой воркер
+STALE_GRACE = 30
+# Сколько ждём чужой пересчёт ключа, которого ещё нет в кеше
+WAIT_TIMEOUT = 0.5
+WAIT_STEP = 0.05
+# Блокировка пересчёта живёт несколько прошлых времён расчёта,
+# а если его ещё не считали - LOCK_TIMEOUT секунд: упавший воркер
+# не запирает ключ надолго
+LOCK_TIMEOUT = 10
+LOCK_FACTOR = 3
+
+_missing = object()
+
+
+class TwoLevelCache(BaseCache):
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self.l2_alias = location
+        self.l1_max_entries = options.get('L1_MAX_ENTRIES', L1_MAX_ENTRIES)
+        self.l1_timeout = options.get('L1_TIMEOUT', L1_TIMEOUT)
+        self.l1_bypass = tuple(options.get('L1_BYPASS', ()))
+        self._l1 = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            'l1': {'hits': 0, 'misses': 0},
+            'l2': {'hits': 0, 'misses': 0},
+        }
+
+    @cached_property
+    def l2(self):
+        return caches[self.l2_alias]
+
+    def stats(self):
+        """Попадания и промахи каждого уровня в этом процессе."""
+        with self._lock:
+            return {
+                layer: dict(counts) for layer, counts in self._stats.items()
+            }
+
+    def _count(self, layer, hits=0, misses=0):
+        with self._lock:
+            self._stats[layer]['hits'] += hits
+            self._stats[layer]['misses'] += misses
+
+    def _local(self, key):
+        return not key.startswith(self.l1_bypass)
+
+    # L1
+
+    def _l1_get(self, key, version):
+        l1_key = self.make_key(key, version)
+        with self._lock:
+            entry = self._l1.get(l1_key)
+            if entry is None:
+                return _missing
+            expires, pickled = entry
+            if expires <= time.monotonic():
+                del self._l1[l1_key]
+                return _missing
+            self._l1.move_to_end(l1_key)
+        return pickle.loads(pickled)
+
+    def _l1_set(self, key, value, timeout, version):
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        ttl = self.l1_timeout if timeout is None else min(
+            timeout, self.l1_timeout
+        )
+        if ttl <= 0:
+            self._l1_delete(key, version)
+            return
+        l1_key = self.make_key(key, version)
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._l1[l1_key] = (time.monotonic() + ttl, pickled)
+            self._l1.move_to_end(l1_key)
+            while len(self._l1) > self.l1_max_entries:
+                self._l1.popitem(last=False)
+
+    def _l1_delete(self, key, version):
+        with self._lock:
+            self._l1.pop(self.make_key(key, version), None)
+
+    # Интерфейс BaseCache
+
+    def get(self, key, default=None, version=None):
+        if self._local(key):
+            value = self._l1_get(key, version)
+            if value is not _missing:
+                self._count('l1', hits=1)
+                return value
+            self._count('l1', misses=1)
+        value = self.l2.get(key, _missing, version=version)
+        if value is _missing:
+            self._count('l2', misses=1)
+            return default
+        self._count('l2', hits=1)
+        if self._local(key):
+            self._l1_set(key, value, DEFAULT_TIMEOUT, version)
+        return value
+
+    def get_many(self, keys, version=None):
+        found = {}
+        remote = []
+        for key in keys:
+            value = _missing
+            if self._local(key):
+                value = self._l1_get(key, version)
+                self._count(
+                    'l1', hits=value is not _missing, misses=value is _missing
+                )
+            if value is _missing:
+                remote.append(key)
+            else:
+                found[key] = value
+        if remote:
+            fetched = self.l2.get_many(remote, version=version)
+            self._count(
+                'l2', hits=len(fetched), misses=len(remote) - len(fetched)
+            )
+            for key, value in fetched.items():
+                if self._local(key):
+                    self._l1_set(key, value, DEFAULT_TIMEOUT, version)
+            found.update(fetched)
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.l2.set(key, value, timeout, version=version)
+        if self._local(key):
+            self._l1_set(key, value, timeout, version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self.l2.set_many(data, timeout, version=version) or []
+        for key, value in data.items():
+            if self._local(key) and key not in failed:
+                self._l1_set(key, value, timeout, version)
+        return failed
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self.l2.add(key, value, timeout, version=version)
+        if added and self._local(key):
+            self._l1_set(key, value, timeout, version)
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        # Срок в L1 короткий и так, старую копию просто выбрасываем
+        self._l1_delete(key, version)
+        return self.l2.touch(key, timeout, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        # Атомарность обеспечивает L2, в L1 число не кешируем
+        self._l1_delete(key, version)
+        return self.l2.incr(key, delta, version=version)
+
+    def delete(self, key, version=None):
+        self._l1_delete(key, version)
+        self.l2.delete(key, version=version)
+
+    def delete_many(self, keys, version=None):
+        for key in keys:
+            self._l1_delete(key, version)
+        self.l2.delete_many(keys, version=version)
+
+    def get_shared(self, key, default=None, version=None):
+        """Значение из L2 мимо копии в L1 (копия обновляется)."""
+        self._l1_delete(key, version)
+        return self.get(key, default, version)
+
+    def has_key(self, key, version=None):
+        return self.get(key, _missing, version=version) is not _missing
+
+    def clear(self):
+        with self._lock:
+            self._l1.clear()
+        self.l2.clear()
+
+
+def _compute_into(key, compute, timeout, version, grace):
+    start = time.monotonic()
+    value = compute()
+    delta = time.monotonic() - start
+    cache.set(
+        key, (value, delta, time.time() + timeout, version), timeout + grace
+    )
+    return value
+
+
+def get_or_refresh(key, compute, timeout, version=None, grace=STALE_GRACE,
+                   beta=1.0):
+    """Значение key из кеша, пересчитанное не более чем одним воркером.
+
+    Запись хранит значение, время его расчёта, срок и версию
+    (например, поколения posts.cache). Устаревшей считается запись
+    с чужой версией, с истёкшим сроком, а также - с вероятностью,
+    растущей к концу срока, - свежая (XFetch): так пересчёты
+    расходятся во времени, а не совпадают с истечением.
+
+    Пересчитывает тот, кто первым взял блокировку key:lock; остальные
+    до grace секунд после срока отдают старое значение. Если старого
+    нет, ждут чужой пересчёт до WAIT_TIMEOUT и считают сами. Запись
+    чужой версии перечитывается мимо L1: другой воркер мог уже
+    положить новую в общий кеш.
+    """
+    entry = cache.get(key)
+    get_shared = getattr(cache, 'get_shared', None)
+    if entry is not None and entry[3] != version and get_shared:
+        entry = get_shared(key)
+    if entry is not None:
+        value, delta, expires, entry_version = entry
+        early = delta * beta * math.log(1 - random.random())
+        if entry_version == version and time.time() - early < expires:
+            return value
+    lock_timeout = LOCK_TIMEOUT
+    if entry is not None:
+        lock_timeout = max(math.ceil(entry[1] * LOCK_FACTOR), 1)
+    lock = f'{key}:lock'
+    if cache.add(lock, 1, lock_timeout):
+        try:
+            return _compute_into(key, compute, timeout, version, grace)
+        finally:
+            cache.delete(lock)
+    if entry is not None:
+        return entry[0]
+    deadline = time.monotonic() + WAIT_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(WAIT_STEP)
+        entry = cache.get(key)
+        if entry is not None and entry[3] == version:
+            return entry[0]
+    return _compute_into(key, compute, timeout, version, grace)
@@ -0,0 +1,53 @@
+"""Дырки в закешированных страницах.
+
+Страница рисуется в два прохода. Сначала общий для всех скелет:
+тег {% hole %} выводит вместо себя метку с именем дырки и её
+аргументами. Затем на каждый запрос метки заменяются отрисовкой
+зарегистрированной дырки для текущего пользователя. Так скелет
+можно кешировать один на всех, а на пользователя тратить только
+несколько маленьких шаблонов.
+"""
+import json
+import re
+from urllib.parse import quote, unquote
+
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+_holes = {}
+
+MARKER = re.compile(r'<!--hole:(\w+):([^>]*)-->')
+
+
+def hole(name, template_name):
+    """Регистрирует дырку name.
+
+    Декорируемая функция получает request и аргументы тега и
+    возвращает контекст для template_name.
+    """
+    def decorator(func):
+        _holes[name] = (template_name, func)
+        return func
+    return decorator
+
+
+def render_hole(request, name, kwargs):
+    template_name, get_context = _holes[name]
+    return render_to_string(
+        template_name, get_context(request, **kwargs), request=request
+    )
+
+
+def marker(name, kwargs):
+    # Аргументы в URL-кодировке не могут закрыть HTML-комментарий
+    return mark_safe(f'<!--hole:{name}:{quote(json.dumps(kwargs))}-->')
+
+
+def fill(content, request):
+    """Заменяет метки дырок их отрисовкой для request."""
+    return MARKER.sub(
+        lambda match: render_hole(
+            request, match.group(1), json.loads(unquote(match.group(2)))
+        ),
+        content,
+    )
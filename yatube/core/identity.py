@@ -0,0 +1,106 @@
+"""Карта идентичности запроса.
+
+Пока идёт HTTP-запрос (core.middleware.identity), каждый загруженный
+экземпляр отслеживаемых моделей запоминается по первичному ключу.
+Ленивые обращения по внешним ключам на эти модели (post.author,
+comment.post) сначала ищут экземпляр в карте и идут в базу, только
+если его там нет. Каждое такое попадание - несделанный запрос, их
+число по моделям отдаёт IdentityMap.hits.
+
+Вне запроса карты нет, и внешние ключи работают как обычно.
+"""
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+from django.apps import apps
+from django.db.models import ForeignKey
+from django.db.models.fields.related_descriptors import (
+    ForwardManyToOneDescriptor,
+)
+from django.db.models.signals import post_init
+
+_local = threading.local()
+
+
+class IdentityMap:
+    def __init__(self):
+        self.instances = {}
+        self.hits = Counter()
+
+    def add(self, instance):
+        if instance.pk is None:
+            return
+        key = (instance._meta.concrete_model, instance.pk)
+        known = self.instances.get(key)
+        # Экземпляр из .only() уступает полному: его отложенные поля
+        # догружались бы отдельными запросами
+        if known is None or (
+            known.get_deferred_fields()
+            and not instance.get_deferred_fields()
+        ):
+            self.instances[key] = instance
+
+    def get(self, model, pk):
+        instance = self.instances.get((model._meta.concrete_model, pk))
+        if instance is not None:
+            self.hits[model._meta.label] += 1
+        return instance
+
+
+def current():
+    """Карта текущего запроса или None."""
+    return getattr(_local, 'map', None)
+
+
+@contextmanager
+def identity_map():
+    """Включает новую карту на время блока и отдаёт её."""
+    previous = current()
+    _local.map = IdentityMap()
+    try:
+        yield _local.map
+    finally:
+        _local.map = previous
+
+
+def remember(instance):
+    """Кладёт в карту экземпляр, созданный без __init__ (из кеша)."""
+    identity = current()
+    if identity is not None and instance is not None:
+        identity.add(instance)
+
+
+class IdentityMapDescriptor(ForwardManyToOneDescriptor):
+    """Внешний ключ, который сначала ищет объект в карте запроса."""
+    def get_object(self, instance):
+        identity = current()
+        if identity is not None:
+            target = identity.get(
+                self.field.remote_field.model,
+                getattr(instance, self.field.attname),
+            )
+            if target is not None:
+                return target
+        return super().get_object(instance)
+
+
+def _remember_loaded(sender, instance, **kwargs):
+    remember(instance)
+
+
+def track(*models):
+    """Отслеживает models и внешние ключи на них во всех моделях."""
+    for model in models:
+        post_init.connect(_remember_loaded, sender=model)
+    for model in apps.get_models():
+        for field in model._meta.get_fields():
+            if (
+                isinstance(field, ForeignKey)
+                and not field.one_to_one
+                and field.remote_field.model in models
+                and field.target_field.primary_key
+                and type(getattr(model, field.name))
+                is ForwardManyToOneDescriptor
+            ):
+                setattr(model, field.name, IdentityMapDescriptor(field))
@@ -0,0 +1,35 @@
+"""Карта идентичности (core.identity) на время каждого запроса.
+
+Стоит первой после инспектора запросов, чтобы в карту попадали и
+пользователь сессии, и всё, что загружают view и шаблоны. Число
+несделанных запросов пишется в лог на уровне DEBUG, а при
+QUERY_INSPECTOR ещё и в заголовок X-Identity-Map-Hits.
+"""
+import logging
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from core.identity import identity_map
+
+logger = logging.getLogger(__name__)
+
+
+class IdentityMapMiddleware:
+    def __init__(self, get_response):
+        if not getattr(settings, 'IDENTITY_MAP', True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with identity_map() as identity:
+            response = self.get_response(request)
+        avoided = sum(identity.hits.values())
+        if avoided:
+            logger.debug(
+                'Карта идентичности на %s сберегла %d запросов: %s',
+                request.path, avoided, dict(identity.hits)
+            )
+        if getattr(settings, 'QUERY_INSPECTOR', False):
+            response['X-Identity-Map-Hits'] = str(avoided)
+        return response
@@ -0,0 +1,140 @@
+"""Кеш целых страниц.
+
+AnonymousPageCacheMiddleware - для анонимных читателей. Стоит в
+начале MIDDLEWARE, до сессий и авторизации: попадание в кеш отдаёт
+готовый ответ без сессии, контекст-процессоров и шаблонов. Запросы
+с cookie сессии (а вошедший пользователь всегда её несёт) идут мимо
+кеша.
+
+Срок жизни задаётся по имени маршрута в settings.PAGE_CACHE_TTLS,
+страницы без срока не кешируются. Версия записи - поколения
+областей PAGE_CACHE_SCOPES из posts.cache, поэтому записи постов,
+комментариев и подписок сразу делают кеш устаревшим.
+
+SkeletonPageCacheMiddleware - для вошедших пользователей. Стоит после
+AuthenticationMiddleware и кеширует один на всех скелет страницы с
+метками дырок (core.holes), а метки заполняет на каждый запрос.
+Сроки задаются в settings.SKELETON_CACHE_TTLS.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse
+from django.urls import Resolver404, resolve
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+
+from core.holes import fill
+from posts.cache import generations
+
+# Поколения, сдвигаемые любой записью поста, комментария и подписки
+PAGE_CACHE_SCOPES = ('all', 'follows')
+
+
+def cacheable(response):
+    # Ответ с cookie (например, csrftoken) или помеченный private
+    # принадлежит одному клиенту
+    return (
+        response.status_code == 200
+        and not response.streaming
+        and not response.cookies
+        and 'private' not in response.get('Cache-Control', '')
+    )
+
+
+def page_key(prefix, request):
+    url = request.build_absolute_uri()
+    return prefix + hashlib.md5(url.encode()).hexdigest()
+
+
+class PageCacheMiddleware:
+    """Общая часть кешей страниц: выбор страниц по маршруту."""
+    ttls_setting = None
+    # Нужна ли запросу cookie сессии, чтобы попасть в этот кеш
+    with_session = False
+
+    def __init__(self, get_response):
+        self.ttls = getattr(settings, self.ttls_setting, {})
+        if not self.ttls:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def ttl(self, request):
+        """Срок кеша страницы или None, если её кешировать нельзя."""
+        if request.method not in ('GET', 'HEAD'):
+            return None
+        has_session = settings.SESSION_COOKIE_NAME in request.COOKIES
+        if has_session != self.with_session:
+            return None
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return None
+        return self.ttls.get(match.view_name)
+
+
+class AnonymousPageCacheMiddleware(PageCacheMiddleware):
+    ttls_setting = 'PAGE_CACHE_TTLS'
+
+    def __call__(self, request):
+        ttl = self.ttl(request)
+        if ttl is None:
+            return self.get_response(request)
+        key = page_key('pages:', request)
+        version = generations(*PAGE_CACHE_SCOPES)
+        entry = cache.get(key)
+        if entry is not None and entry[0] == version:
+            response = entry[1]
+            response['X-Page-Cache'] = 'hit'
+            return get_conditional_response(
+                request, etag=response.get('ETag'), response=response
+            )
+        response = self.get_response(request)
+        if cacheable(response):
+            cache.set(key, (version, response), ttl)
+        response['X-Page-Cache'] = 'miss'
+        return response
+
+
+class SkeletonPageCacheMiddleware(PageCacheMiddleware):
+    ttls_setting = 'SKELETON_CACHE_TTLS'
+    with_session = True
+
+    def __call__(self, request):
+        ttl = self.ttl(request)
+        if ttl is None:
+            return self.get_response(request)
+        key = page_key('skeletons:', request)
+        version = generations(*PAGE_CACHE_SCOPES)
+        # Любая запись поста, комментария или подписки сдвигает
+        # версию, поэтому ETag из неё и сессии верен для всей страницы
+        etag = quote_etag(hashlib.md5(repr([
+            key, request.COOKIES[settings.SESSION_COOKIE_NAME], version
+        ]).encode()).hexdigest())
+        entry = cache.get(key)
+        if entry is not None and entry[0] == version:
+            skeleton, content_type = entry[1:]
+            response = get_conditional_response(request, etag=etag)
+            if response is None:
+                response = HttpResponse(
+                    fill(skeleton, request), content_type=content_type
+                )
+            response['ETag'] = etag
+            response['X-Page-Cache'] = 'hit'
+            return response
+        # Дырки в этом проходе выводят метки, а не отрисовку
+        request.punch_holes = True
+        response = self.get_response(request)
+        request.punch_holes = False
+        if not cacheable(response):
+            return response
+        skeleton = response.content.decode(response.charset)
+        cache.set(key, (version, skeleton, response['Content-Type']), ttl)
+        response.content = fill(skeleton, request)
+        if response.has_header('Content-Length'):
+            response['Content-Length'] = str(len(response.content))
+        response['ETag'] = etag
+        response['X-Page-Cache'] = 'miss'
+        return response
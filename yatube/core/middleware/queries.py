@@ -0,0 +1,75 @@
+"""Учёт SQL-запросов каждого HTTP-запроса и поиск N+1.
+
+Включается только для разработки и стенда (settings.QUERY_INSPECTOR).
+Одинаковые по тексту запросы, выполненные из одного места кода
+больше QUERY_INSPECTOR_THRESHOLD раз, попадают в лог как N+1.
+"""
+import logging
+import os
+import traceback
+from collections import Counter
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+# Сколько одинаковых запросов из одного места ещё не считаются N+1
+THRESHOLD = 3
+
+
+def call_site():
+    """Последний кадр стека из кода проекта: файл, строка, функция."""
+    this_file = os.path.abspath(__file__)
+    for frame in reversed(traceback.extract_stack()):
+        filename = os.path.abspath(frame.filename)
+        if (
+            filename.startswith(settings.BASE_DIR)
+            and filename != this_file
+            and 'site-packages' not in filename
+        ):
+            return f'{frame.filename}:{frame.lineno} ({frame.name})'
+    return 'неизвестно'
+
+
+class QueryRecorder:
+    """execute_wrapper, запоминающий текст и место вызова запросов."""
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        # Параметры в текст не подставлены, поэтому запросы N+1
+        # с разными id совпадают по тексту
+        self.queries.append((call_site(), sql))
+        return execute(sql, params, many, context)
+
+    def repeated(self, threshold):
+        """Пары (место, запрос), повторившиеся больше threshold раз."""
+        return [
+            (site, sql, count)
+            for (site, sql), count in Counter(self.queries).most_common()
+            if count > threshold
+        ]
+
+
+class QueryInspectorMiddleware:
+    def __init__(self, get_response):
+        if not getattr(settings, 'QUERY_INSPECTOR', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.threshold = getattr(
+            settings, 'QUERY_INSPECTOR_THRESHOLD', THRESHOLD
+        )
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            response = self.get_response(request)
+        response['X-Query-Count'] = str(len(recorder.queries))
+        for site, sql, count in recorder.repeated(self.threshold):
+            logger.warning(
+                'N+1 на %s: запрос выполнен %d раз из %s: %s',
+                request.path, count, site, sql
+            )
+        return response
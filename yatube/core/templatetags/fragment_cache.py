@@ -0,0 +1,37 @@
+from django import template
+
+from core.cache import get_or_refresh
+
+register = template.Library()
+
+
+class FragmentCacheNode(template.Node):
+    def __init__(self, nodelist, params):
+        self.nodelist = nodelist
+        self.params = params
+
+    def render(self, context):
+        params = self.params.resolve(context)
+        return get_or_refresh(
+            params['key'],
+            lambda: self.nodelist.render(context),
+            params['timeout'],
+            version=params.get('version'),
+        )
+
+
+@register.tag
+def fragment_cache(parser, token):
+    """Кеширует фрагмент через core.cache.get_or_refresh.
+
+    {% fragment_cache params %} ... {% endfragment_cache %}, где
+    params - словарь с key, timeout и version (posts.cache).
+    """
+    bits = token.split_contents()
+    if len(bits) != 2:
+        raise template.TemplateSyntaxError(
+            f'{bits[0]} принимает ровно один аргумент'
+        )
+    nodelist = parser.parse(('endfragment_cache',))
+    parser.delete_first_token()
+    return FragmentCacheNode(nodelist, parser.compile_filter(bits[1]))
@@ -0,0 +1,18 @@
+from django import template
+
+from core import holes
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def hole(context, name, **kwargs):
+    """Дырка core.holes: метка в скелете или готовая отрисовка.
+
+    Аргументы попадают в метку как JSON, поэтому передавать
+    можно только строки, числа и булевы значения.
+    """
+    request = context.get('request')
+    if getattr(request, 'punch_holes', False):
+        return holes.marker(name, kwargs)
+    return holes.render_hole(request, name, kwargs)
@@ -0,0 +1,16 @@
+from django import template
+
+from posts.paginators import ELLIPSIS, elided_page_range
+
+register = template.Library()
+
+
+@register.simple_tag
+def page_links(page_obj):
+    """Свёрнутый список номеров страниц вокруг текущей."""
+    return elided_page_range(page_obj.number, page_obj.paginator.num_pages)
+
+
+@register.filter
+def is_ellipsis(item):
+    return item == ELLIPSIS
@@ -3,3 +3,11 @@ from django.apps import AppConfig
 
 class PostsConfig(AppConfig):
     name = 'posts'
+
+    def ready(self):
+        # Подключаем обработчики сигналов моделей и дырки страниц
+        from . import holes, signals  # noqa: F401
+        from core.identity import track
+        from .models import Group, Post, User
+        # Авторы, группы и посты внутри запроса грузятся один раз
+        track(User, Group, Post)
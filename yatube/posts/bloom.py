@@ -0,0 +1,36 @@
+"""Фильтр Блума для быстрого ответа «такого точно нет»."""
+import hashlib
+import math
+
+
+class BloomFilter:
+    """Множество без ложных отрицаний и с долей ложных срабатываний.
+
+    Размер битового массива и число хешей подбираются по ожидаемому
+    числу элементов capacity и допустимой доле ошибок error_rate.
+    """
+    def __init__(self, capacity, error_rate=0.01):
+        capacity = max(capacity, 1)
+        self.size = max(8, math.ceil(
+            -capacity * math.log(error_rate) / math.log(2) ** 2
+        ))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value):
+        # Двойное хеширование: k позиций из двух половин одного md5
+        digest = hashlib.md5(str(value).encode()).digest()
+        first = int.from_bytes(digest[:8], 'big')
+        second = int.from_bytes(digest[8:], 'big') | 1
+        for i in range(self.hashes):
+            yield (first + i * second) % self.size
+
+    def add(self, value):
+        for position in self._positions(value):
+            self.bits[position // 8] |= 1 << (position % 8)
+
+    def __contains__(self, value):
+        return all(
+            self.bits[position // 8] & (1 << (position % 8))
+            for position in self._positions(value)
+        )
@@ -0,0 +1,121 @@
+"""Версионированный кеш фрагментов лент.
+
+Каждая область ленты (вся лента, группа, автор, подписки
+пользователя) хранит в кеше счётчик поколения. Поколения входят в
+версию фрагмента, поэтому сигналы Post и Comment не ищут и не
+удаляют старые фрагменты, а только увеличивают поколение: запись
+с прежней версией считается устаревшей и пересчитывается.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+# Сколько живёт фрагмент, если лента не менялась
+FEED_CACHE_TIMEOUT = 60 * 60
+
+
+def generation_key(scope):
+    return f'posts:gen:{scope}'
+
+
+def new_generation():
+    # Поколение, вытесненное из кеша, начинается с текущего времени,
+    # а не с единицы, и не совпадёт ни с одним уже выданным
+    return time.time_ns()
+
+
+def generations(*scopes):
+    """Текущие поколения областей одним запросом к кешу."""
+    keys = [generation_key(scope) for scope in scopes]
+    found = cache.get_many(keys)
+    missing = {key: new_generation() for key in keys if key not in found}
+    if missing:
+        cache.set_many(missing, None)
+        found.update(missing)
+    return [found[key] for key in keys]
+
+
+def bump(*scopes):
+    """Сдвигает поколения областей после изменения их содержимого."""
+    for scope in scopes:
+        key = generation_key(scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, new_generation(), None)
+
+
+def repeat_on_commit(func):
+    """Вызывает func сейчас и ещё раз после коммита транзакции.
+
+    Страница, прочитанная между первым вызовом и коммитом, попала бы
+    в кеш со старыми данными под новой версией; повторный вызов
+    после коммита её отбрасывает.
+    """
+    func()
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(func)
+
+
+def bump_on_commit(*scopes):
+    """Сдвигает поколения сейчас и ещё раз после коммита."""
+    repeat_on_commit(lambda: bump(*scopes))
+
+
+def post_scopes(post, group_id=None):
+    """Области лент, в которых показывается пост, и сам пост."""
+    scopes = ['all', f'author:{post.author_id}', f'post:{post.pk}']
+    for pk in {post.group_id, group_id} - {None}:
+        scopes.append(f'group:{pk}')
+    return scopes
+
+
+def user_scopes(user):
+    """Области лент, где показано имя пользователя: с его постами."""
+    group_ids = user.posts.exclude(group=None).order_by().values_list(
+        'group_id', flat=True
+    ).distinct()
+    return ['all', f'author:{user.pk}', *(f'group:{pk}' for pk in group_ids)]
+
+
+def group_scopes(group):
+    """Области лент, где показана группа: с её постами."""
+    author_ids = group.posts.order_by().values_list(
+        'author_id', flat=True
+    ).distinct()
+    return ['all', f'group:{group.pk}', *(f'author:{pk}' for pk in author_ids)]
+
+
+def feed_fragment(request, feed, *scopes):
+    """Параметры {% fragment_cache %} для ленты: ключ, срок и версия.
+
+    Ключ собирается из имени ленты, страницы или курсора и областей,
+    версия - из поколений этих областей. Запись старой версии не
+    выбрасывается сразу: core.cache.get_or_refresh отдаёт её, пока
+    новую страницу пересчитывает другой воркер.
+    """
+    parts = [feed, request.GET.get('page'), request.GET.get('cursor')]
+    parts += scopes
+    digest = hashlib.md5(repr(parts).encode()).hexdigest()
+    return {
+        'key': f'posts:fragment:{digest}',
+        'timeout': getattr(
+            settings, 'FEED_CACHE_TIMEOUT', FEED_CACHE_TIMEOUT
+        ),
+        'version': generations(*scopes),
+    }
+
+
+def page_etag(request, *scopes):
+    """ETag страницы из поколений областей, без запросов к базе.
+
+    В ETag входит и сессия: шапка, кнопки подписки и форма
+    комментария у каждого пользователя свои. Берём ключ сессии из
+    cookie, а не request.user, чтобы не читать сессию из базы.
+    """
+    session = request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    parts = [session, *scopes, *generations(*scopes)]
+    return hashlib.md5(repr(parts).encode()).hexdigest()
@@ -0,0 +1,61 @@
+"""Кеш отрисованных карточек постов.
+
+Карточка одна на все ленты, поэтому её HTML кешируется по посту,
+а не по странице: популярный пост рисуется один раз, в какую бы
+ленту и на какую страницу он ни попал. Версия в ключе - хеш
+полей карточки, так что правка поста, автора или группы и готовая
+миниатюра сами уводят на новый ключ.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from . import thumbnails
+
+CARD_TEMPLATE = 'includes/post_card.html'
+CARD_CACHE_TIMEOUT = 24 * 60 * 60
+
+
+def card_version(post):
+    group = post.group
+    author = post.author
+    fields = (
+        post.excerpt, post.pub_date.isoformat(), post.image.name,
+        thumbnails.ready(post), post.comments_count,
+        group and (group.slug, group.title),
+        author.username, author.first_name, author.last_name,
+    )
+    return hashlib.md5(repr(fields).encode()).hexdigest()
+
+
+def card_key(post):
+    return f'posts:card:{post.pk}:{card_version(post)}'
+
+
+def post_cards(posts):
+    """HTML карточек постов одним get_many.
+
+    Рисуются и записываются set_many только карточки,
+    которых в кеше не оказалось. Миниатюры, от которых зависит
+    версия карточки, берутся заранее тоже одним get_many.
+    """
+    posts = list(posts)
+    thumbnails.prefetch(posts)
+    keys = [card_key(post) for post in posts]
+    found = cache.get_many(keys)
+    stale = [
+        (key, post) for key, post in zip(keys, posts) if key not in found
+    ]
+    missing = {
+        key: render_to_string(CARD_TEMPLATE, {'post': post})
+        for key, post in stale
+    }
+    if missing:
+        cache.set_many(missing, getattr(
+            settings, 'CARD_CACHE_TIMEOUT', CARD_CACHE_TIMEOUT
+        ))
+        found.update(missing)
+    return [mark_safe(found[key]) for key in keys]
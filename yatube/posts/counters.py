@@ -0,0 +1,103 @@
+"""Денормализованные счётчики постов, комментариев и подписок.
+
+Счётчики меняются одним UPDATE с F-выражением, без чтения строки,
+поэтому параллельные записи не теряют друг друга. Если счётчики
+разошлись с данными (bulk_create, правки в обход моделей), их
+пересчитывает команда rebuild_counters.
+"""
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import Comment, Follow, Group, Post, User, UserCounters
+
+
+def bump(queryset, **deltas):
+    """Сдвигает счётчики строк queryset, не опуская их ниже нуля."""
+    return queryset.update(**{
+        field: Greatest(F(field) + delta, 0)
+        for field, delta in deltas.items()
+    })
+
+
+def bump_user(user_id, **deltas):
+    counters = UserCounters.objects.filter(user_id=user_id)
+    if bump(counters, **deltas) or min(deltas.values()) < 0:
+        # Строку не создаём при уменьшении: так бывает, когда
+        # пользователь удаляется вместе со своими постами
+        return
+    # Строки ещё нет: счётчики такого пользователя начинаются с нуля
+    UserCounters.objects.get_or_create(user_id=user_id)
+    bump(counters, **deltas)
+
+
+def post_added(post, delta=1):
+    bump_user(post.author_id, posts_count=delta)
+    if post.group_id:
+        bump(Group.objects.filter(pk=post.group_id), posts_count=delta)
+
+
+def post_moved(old_group_id, new_group_id):
+    if old_group_id:
+        bump(Group.objects.filter(pk=old_group_id), posts_count=-1)
+    if new_group_id:
+        bump(Group.objects.filter(pk=new_group_id), posts_count=1)
+
+
+def comment_added(comment, delta=1):
+    bump(Post.objects.filter(pk=comment.post_id), comments_count=delta)
+
+
+def follow_added(follow, delta=1):
+    bump_user(follow.author_id, followers_count=delta)
+    bump_user(follow.user_id, following_count=delta)
+
+
+def counted(model, field):
+    """Подзапрос количества строк model, ссылающихся на OuterRef('pk')."""
+    rows = model.objects.filter(
+        **{field: OuterRef('pk')}
+    ).order_by().values(field).annotate(total=Count('pk'))
+    return Coalesce(
+        Subquery(rows.values('total'), output_field=IntegerField()), 0
+    )
+
+
+def user_counters(user):
+    """Счётчики пользователя; строку, которой нет, создаёт по таблицам.
+
+    Строки может не быть у пользователей из bulk_create, фикстур
+    или SQL в обход сигналов.
+    """
+    try:
+        return user.counters
+    except UserCounters.DoesNotExist:
+        pass
+    counts = User.objects.filter(pk=user.pk).values(
+        posts_count=counted(Post, 'author'),
+        followers_count=counted(Follow, 'author'),
+        following_count=counted(Follow, 'user'),
+    ).first() or {}
+    user.counters, _ = UserCounters.objects.get_or_create(
+        user_id=user.pk, defaults=counts
+    )
+    return user.counters
+
+
+def rebuild():
+    """Пересчитывает все счётчики по данным таблиц."""
+    Group.objects.update(posts_count=counted(Post, 'group'))
+    Post.objects.update(comments_count=counted(Comment, 'post'))
+    UserCounters.objects.bulk_create(
+        [
+            UserCounters(user_id=pk)
+            for pk in User.objects.filter(
+                counters__isnull=True
+            ).values_list('pk', flat=True)
+        ],
+        ignore_conflicts=True,
+    )
+    UserCounters.objects.update(
+        posts_count=counted(Post, 'author'),
+        followers_count=counted(Follow, 'author'),
+        following_count=counted(Follow, 'user'),
+    )
@@ -0,0 +1,202 @@
+"""Движки ленты подписок.
+
+Какой движок строит /follow/, задаёт settings.FOLLOW_FEED_ENGINE:
+'join' - соединение Follow и Post при каждом чтении,
+'timeline' - материализованная лента из posts.timelines,
+'merge' - слияние закешированных списков свежих постов каждого автора.
+
+Движки 'timeline' и 'merge' собирают страницу k-way слиянием
+упорядоченных потоков ключей (pub_date, id): каждый поток читается
+по своему индексу, сортировки в базе нет, а посты поднимаются
+одним запросом только для самой страницы.
+"""
+import heapq
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Follow, Post, TimelineEntry
+from .paginators import PREVIOUS
+from .timelines import pulled_author_ids
+
+# Сколько последних постов автора держим в кеше для слияния
+RECENT_POSTS = 200
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def sort_key(pub_date, pk):
+    # Целые микросекунды сравниваются точно, в отличие от float
+    return (pub_date - EPOCH) // timedelta(microseconds=1), pk
+
+
+def hydrate(ids):
+    """Загружает посты страницы одним запросом, сохраняя порядок."""
+    posts = Post.objects.feed().in_bulk(ids)
+    return [posts[pk] for pk in ids if pk in posts]
+
+
+class QueryStream:
+    """Поток ключей постов из запроса, упорядоченного по индексу."""
+    def __init__(self, queryset, date_field, id_field):
+        self.queryset = queryset
+        self.date_field = date_field
+        self.id_field = id_field
+
+    def keys(self, position, limit):
+        date, pk = self.date_field, self.id_field
+        rows = self.queryset.order_by(f'-{date}', f'-{pk}')
+        if position is not None:
+            direction, pub_date, post_id = position
+            if direction == PREVIOUS:
+                rows = rows.filter(
+                    Q(**{f'{date}__gt': pub_date})
+                    | Q(**{date: pub_date, f'{pk}__gt': post_id})
+                ).order_by(date, pk)
+            else:
+                rows = rows.filter(
+                    Q(**{f'{date}__lt': pub_date})
+                    | Q(**{date: pub_date, f'{pk}__lt': post_id})
+                )
+        return [
+            sort_key(pub_date, post_id)
+            for pub_date, post_id in rows.values_list(date, pk)[:limit]
+        ]
+
+    def count(self):
+        return self.queryset.count()
+
+
+class ListStream:
+    """Поток ключей из готового списка, отсортированного по убыванию."""
+    def __init__(self, keys):
+        self.ascending = keys[::-1]
+
+    def keys(self, position, limit):
+        if position is None:
+            return self.ascending[::-1][:limit]
+        direction, pub_date, pk = position
+        key = sort_key(pub_date, pk)
+        if direction == PREVIOUS:
+            start = bisect_right(self.ascending, key)
+            return self.ascending[start:start + limit]
+        end = bisect_left(self.ascending, key)
+        return self.ascending[max(end - limit, 0):end][::-1]
+
+    def count(self):
+        return len(self.ascending)
+
+
+class MergedFeed:
+    """Лента из k-way слияния потоков ключей постов.
+
+    Ведёт себя как последовательность для Paginator и умеет seek для
+    CursorPaginator. Из базы поднимаются только посты самой страницы.
+    """
+    def __init__(self, streams):
+        self.streams = list(streams)
+
+    def window(self, position, limit):
+        """Первые limit ключей всех потоков за позицией курсора."""
+        backward = position is not None and position[0] == PREVIOUS
+        merged = heapq.merge(
+            *(stream.keys(position, limit) for stream in self.streams),
+            reverse=not backward
+        )
+        return [pk for _, pk in list(merged)[:limit]]
+
+    def count(self):
+        return sum(stream.count() for stream in self.streams)
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            ids = self.window(None, index.stop)[index]
+            return hydrate(ids)
+        return self[index:index + 1][0]
+
+    def seek(self, position, limit):
+        """Как CursorPaginator.seek, но по слитым потокам."""
+        return hydrate(self.window(position, limit))
+
+
+def join_feed(user):
+    return Post.objects.filter(author__following__user=user).feed()
+
+
+def timeline_feed(user):
+    # Разложенные посты берём из ленты, посты авторов с огромным
+    # числом подписчиков - напрямую из Post по индексу автора. Автор
+    # мог набрать подписчиков уже после раскладки, поэтому его строки
+    # в ленте пропускаем, чтобы посты не повторялись
+    pulled = list(pulled_author_ids(user))
+    entries = TimelineEntry.objects.filter(user=user).exclude(
+        author_id__in=pulled
+    )
+    streams = [QueryStream(entries, 'pub_date', 'post_id')]
+    streams += [
+        QueryStream(Post.objects.filter(author_id=author_id), 'pub_date', 'id')
+        for author_id in pulled
+    ]
+    return MergedFeed(streams)
+
+
+def recent_posts_key(author_id):
+    return f'posts:recent:{author_id}'
+
+
+def forget_recent_posts(author_id):
+    """Сбрасывает кеш свежих постов автора после записи."""
+    cache.delete(recent_posts_key(author_id))
+
+
+def recent_posts(author_ids):
+    """Списки ключей сортировки свежих постов каждого автора.
+
+    Все списки берутся из кеша одним get_many; в базу идём только
+    за авторами, которых в кеше не оказалось.
+    """
+    size = getattr(settings, 'AUTHOR_RECENT_POSTS', RECENT_POSTS)
+    keys = {recent_posts_key(author_id): author_id for author_id in author_ids}
+    found = cache.get_many(keys)
+    missing = {
+        key: QueryStream(
+            Post.objects.filter(author_id=author_id), 'pub_date', 'id'
+        ).keys(None, size)
+        for key, author_id in keys.items()
+        if key not in found
+    }
+    if missing:
+        cache.set_many(missing)
+        found.update(missing)
+    return list(found.values())
+
+
+def merge_feed(user):
+    author_ids = Follow.objects.filter(user=user).values_list(
+        'author_id', flat=True
+    )
+    return MergedFeed(ListStream(keys) for keys in recent_posts(author_ids))
+
+
+ENGINES = {
+    'join': join_feed,
+    'timeline': timeline_feed,
+    'merge': merge_feed,
+}
+
+
+def follow_feed(user):
+    """Посты авторов, на которых подписан пользователь."""
+    engine = getattr(settings, 'FOLLOW_FEED_ENGINE', 'join')
+    if engine not in ENGINES:
+        raise ImproperlyConfigured(
+            f'Неизвестный движок ленты подписок: {engine!r}'
+        )
+    return ENGINES[engine](user)
@@ -1,5 +1,9 @@
 from django import forms
 
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import UploadedFile
+
+from .images import check_size, prepare_upload
 from .models import Post, Comment
 
 
@@ -18,6 +22,26 @@ class PostForm(forms.ModelForm):
             'image': 'Из жесткого диска',
         }
 
+    def clean_image(self):
+        # Лимиты и пересборка загруженной картинки - в posts.images
+        image = self.cleaned_data.get('image')
+        if isinstance(image, UploadedFile):
+            return prepare_upload(image)
+        return image
+
+    def clean(self):
+        cleaned_data = super().clean()
+        # Файл сверх лимита записан не целиком, и ImageField называет
+        # его битой картинкой; показываем настоящую причину
+        upload = self.files.get(self.add_prefix('image'))
+        if upload is not None:
+            try:
+                check_size(upload)
+            except ValidationError as error:
+                self.errors.pop('image', None)
+                self.add_error('image', error)
+        return cleaned_data
+
 
 class CommentForm(forms.ModelForm):
     class Meta:
@@ -0,0 +1,27 @@
+"""Пользовательские дырки страниц постов (core.holes)."""
+from core.holes import hole
+
+from .models import Follow
+
+
+@hole('header', 'includes/header.html')
+def header(request):
+    return {}
+
+
+@hole('switcher', 'includes/switcher.html')
+def switcher(request, index=False, profile=False):
+    return {'index': index, 'profile': profile}
+
+
+@hole('follow_button', 'includes/follow_button.html')
+def follow_button(request, author):
+    following = request.user.is_authenticated and Follow.objects.filter(
+        user=request.user, author__username=author
+    ).exists()
+    return {'author': author, 'following': following}
+
+
+@hole('comment_form', 'includes/comment_form.html')
+def comment_form(request, post_id):
+    return {'post_id': post_id}
@@ -0,0 +1,217 @@
+"""Загрузка картинок постов и сведения о них.
+
+Загрузка пишется во временный файл (LimitedUploadHandler), и на
+диск попадает не больше IMAGE_MAX_BYTES. Прежде чем декодировать
+картинку, prepare_upload проверяет вес файла и число пикселей из
+заголовка, а затем пересобирает её не больше IMAGE_MAX_SIDE по
+большей стороне и без EXIF. JPEG сразу декодируется уменьшенным
+(draft), поэтому ему хватает IMAGE_MAX_PIXELS. Остальные форматы
+Pillow декодирует целиком и только потом ужимает reduce, и для них
+число пикселей ограничено меньшим IMAGE_MAX_FULL_PIXELS. Форматы не
+из SAVED_FORMATS (TIFF, BMP и другие) сохраняются в PNG, если в них
+есть прозрачность или палитра, иначе в JPEG; как есть проходит
+только анимированный GIF.
+
+Размеры, вес файла, основной цвет и крошечная заглушка (LQIP)
+считаются один раз, когда к посту прикрепляют новый файл, и лежат
+в строке поста. Шаблоны ставят по ним размеры и заглушку для
+ленивой загрузки, не открывая файл картинки на каждом показе.
+"""
+import base64
+import logging
+import os
+import tempfile
+from io import BytesIO
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile, UploadedFile
+from django.core.files.uploadhandler import (
+    StopUpload, TemporaryFileUploadHandler,
+)
+from django.forms import ImageField
+from django.template.defaultfilters import filesizeformat
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+IMAGE_MAX_BYTES = 10 * 1024 * 1024
+IMAGE_MAX_PIXELS = 40 * 1000 * 1000
+# Предел для форматов, которые декодируются в полном размере
+IMAGE_MAX_FULL_PIXELS = 16 * 1000 * 1000
+IMAGE_MAX_SIDE = 2560
+# В каком формате сохранять картинку каждого формата; MPO - JPEG
+# с несколькими кадрами
+SAVED_FORMATS = {
+    'JPEG': 'JPEG', 'MPO': 'JPEG', 'PNG': 'PNG', 'WEBP': 'WEBP',
+    'GIF': 'GIF',
+}
+# Расширения файлов, пересохранённых в другом формате
+EXTENSIONS = {'JPEG': '.jpg', 'PNG': '.png'}
+JPEG_QUALITY = 90
+
+# Сторона заглушки в пикселях и качество её JPEG
+PLACEHOLDER_SIZE = 16
+PLACEHOLDER_QUALITY = 40
+
+IMAGE_FIELDS = (
+    'image_width', 'image_height', 'image_size',
+    'image_color', 'image_placeholder',
+)
+
+
+def clear_image_info(post):
+    post.image_width = post.image_height = post.image_size = None
+    post.image_color = post.image_placeholder = ''
+
+
+def describe_image(post):
+    """Заполняет поля сведений о картинке поста из её файла.
+
+    Картинку, которую не удалось прочитать, оставляет без сведений.
+    """
+    clear_image_info(post)
+    if not post.image:
+        return
+    try:
+        post.image.seek(0)
+        with Image.open(post.image) as image:
+            width, height = image.size
+            # JPEG сразу декодируется в уменьшенном виде
+            image.draft('RGB', (PLACEHOLDER_SIZE * 2, PLACEHOLDER_SIZE * 2))
+            small = image.convert('RGB')
+        post.image.seek(0)
+    except (OSError, ValueError) as error:
+        logger.warning('Не прочитать картинку %s: %s', post.image, error)
+        return
+    small.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE))
+    red, green, blue = small.resize((1, 1), Image.BOX).getpixel((0, 0))
+    buffer = BytesIO()
+    small.save(buffer, 'JPEG', quality=PLACEHOLDER_QUALITY)
+    post.image_width = width
+    post.image_height = height
+    post.image_size = post.image.size
+    post.image_color = f'#{red:02x}{green:02x}{blue:02x}'
+    post.image_placeholder = 'data:image/jpeg;base64,' + base64.b64encode(
+        buffer.getvalue()
+    ).decode()
+
+
+def max_bytes():
+    return getattr(settings, 'IMAGE_MAX_BYTES', IMAGE_MAX_BYTES)
+
+
+class LimitedUploadHandler(TemporaryFileUploadHandler):
+    """Временный файл загрузки не больше IMAGE_MAX_BYTES.
+
+    На первом байте сверх лимита загрузка обрывается, и остаток
+    тела запроса не читается. Вместо файла в request.rejected_uploads
+    остаётся пустая заглушка с размером больше лимита, и форма,
+    получив её через request_files, отклоняет файл по check_size.
+    """
+    def receive_data_chunk(self, raw_data, start):
+        size = start + len(raw_data)
+        if size > max_bytes():
+            stub = SimpleUploadedFile(self.file_name, b'', self.content_type)
+            stub.size = size
+            if not hasattr(self.request, 'rejected_uploads'):
+                self.request.rejected_uploads = {}
+            self.request.rejected_uploads[self.field_name] = stub
+            raise StopUpload(connection_reset=True)
+        return super().receive_data_chunk(raw_data, start)
+
+
+def request_files(request):
+    """Файлы запроса вместе с заглушками оборванных загрузок."""
+    rejected = getattr(request, 'rejected_uploads', None)
+    if not rejected:
+        return request.FILES
+    files = request.FILES.copy()
+    for field_name, stub in rejected.items():
+        files[field_name] = stub
+    return files
+
+
+def check_size(upload):
+    limit = max_bytes()
+    if upload.size > limit:
+        raise ValidationError(
+            f'Файл больше {filesizeformat(limit)}', code='too_large'
+        )
+
+
+def saved_format(image):
+    """Формат, в котором сохраняется загруженная картинка."""
+    if image.format in SAVED_FORMATS:
+        return SAVED_FORMATS[image.format]
+    if image.mode in ('RGBA', 'LA', 'PA', 'P') or (
+        'transparency' in image.info
+    ):
+        return 'PNG'
+    return 'JPEG'
+
+
+def prepare_upload(upload):
+    """Проверяет загруженную картинку и пересобирает её без EXIF.
+
+    Возвращает новый файл или исходный для анимированного GIF.
+    Картинку, которую Pillow не смог декодировать (например,
+    обрезанную), отклоняет так же, как ImageField.
+    """
+    check_size(upload)
+    upload.seek(0)
+    try:
+        return reencode(upload)
+    except (OSError, ValueError, Image.DecompressionBombError) as error:
+        raise ValidationError(
+            ImageField.default_error_messages['invalid_image'],
+            code='invalid_image'
+        ) from error
+
+
+def reencode(upload):
+    max_pixels = getattr(settings, 'IMAGE_MAX_PIXELS', IMAGE_MAX_PIXELS)
+    max_side = getattr(settings, 'IMAGE_MAX_SIDE', IMAGE_MAX_SIDE)
+    with Image.open(upload) as image:
+        if image.format not in ('JPEG', 'MPO'):
+            max_pixels = min(max_pixels, getattr(
+                settings, 'IMAGE_MAX_FULL_PIXELS', IMAGE_MAX_FULL_PIXELS
+            ))
+        # Размер известен из заголовка, пиксели ещё не декодированы
+        width, height = image.size
+        if width * height > max_pixels:
+            raise ValidationError(
+                f'Картинка больше {max_pixels / 10 ** 6:g} мегапикселей',
+                code='too_many_pixels'
+            )
+        if image.format == 'GIF' and getattr(image, 'is_animated', False):
+            upload.seek(0)
+            return upload
+        source_format = image.format
+        image_format = saved_format(image)
+        if source_format in ('JPEG', 'MPO'):
+            image.draft('RGB', (max_side, max_side))
+        elif max(width, height) >= max_side * 2 and image.mode != 'P':
+            image = image.reduce(max(width, height) // max_side)
+        image = ImageOps.exif_transpose(image)
+    image.thumbnail((max_side, max_side))
+    for key in ('exif', 'xmp', 'XML:com.adobe.xmp'):
+        image.info.pop(key, None)
+    options = {}
+    if image_format == 'JPEG':
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        options['quality'] = JPEG_QUALITY
+    # Большой результат уходит из памяти на диск
+    spooled = tempfile.SpooledTemporaryFile(
+        max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE
+    )
+    image.save(spooled, image_format, **options)
+    size = spooled.tell()
+    spooled.seek(0)
+    name = upload.name
+    if image_format != source_format:
+        name = os.path.splitext(name)[0] + EXTENSIONS[image_format]
+    return UploadedFile(
+        spooled, name, Image.MIME[image_format], size, upload.charset
+    )
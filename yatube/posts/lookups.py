@@ -0,0 +1,235 @@
+"""Поиск пользователей, групп и постов из URL с кешем промахов.
+
+Боты перебирают несуществующие /profile/<username>/,
+/group/<slug>/ и /posts/<id>/. Промах запоминается в кеше на
+NEGATIVE_LOOKUP_TIMEOUT, и повторные запросы получают 404 без
+базы. Запись в кеше снимают сигналы при создании объекта.
+
+С settings.LOOKUP_BLOOM_FILTER каждый процесс держит ещё фильтр
+Блума имён пользователей и слагов групп: имя, которого нет в
+фильтре, отсекается даже без обращения к кешу промахов. Новые имена
+не перестраивают фильтр, а пишутся в общий журнал в кеше, и каждый
+процесс дописывает их в свой фильтр. Целиком из базы фильтр
+строится раз в LOOKUP_BLOOM_REBUILD_AFTER секунд (так из него
+уходят переименованные и удалённые), когда журнал перерос фильтр
+или его запись вытеснена из кеша, и при смене поколения в
+posts.cache.
+
+Найденные пользователи и группы кешируются на LOOKUP_CACHE_TIMEOUT
+облегчёнными экземплярами: у пользователя только поля CACHED_FIELDS,
+счётчики (UserCounters) в запись не попадают. Счётчик постов группы
+в записи может отставать и годится только как оценка. Записи снимают
+сигналы сохранения и удаления User и Group; в L1 других воркеров
+старая копия живёт ещё до L1_TIMEOUT секунд. Попадания и промахи
+процесса отдаёт lookup_stats.
+"""
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import Http404
+
+from core.identity import remember
+
+from .bloom import BloomFilter
+from .cache import generations, repeat_on_commit
+from .models import Group, Post, User
+
+NEGATIVE_LOOKUP_TIMEOUT = 10 * 60
+LOOKUP_CACHE_TIMEOUT = 60 * 60
+BLOOM_REBUILD_AFTER = 60 * 60
+# Фильтр строится с запасом под имена из журнала, но не меньше
+# чем на BLOOM_MIN_CAPACITY имён
+BLOOM_MIN_CAPACITY = 1000
+
+# Вид поиска: модель и поле, по которому ищем из URL
+KINDS = {
+    'user': (User, 'username'),
+    'group': (Group, 'slug'),
+    'post': (Post, 'pk'),
+}
+# Виды, для которых строится фильтр Блума
+BLOOM_KINDS = ('user', 'group')
+# Виды, найденные экземпляры которых кешируются, и поля этих
+# экземпляров (None - все поля)
+CACHED_FIELDS = {
+    'user': ('id', 'username', 'first_name', 'last_name'),
+    'group': None,
+}
+
+_filters = {}
+_stats = {kind: {'hits': 0, 'misses': 0} for kind in CACHED_FIELDS}
+_stats_lock = threading.Lock()
+
+
+def missing_key(kind, value):
+    digest = hashlib.md5(str(value).encode()).hexdigest()
+    return f'posts:missing:{kind}:{digest}'
+
+
+def lookup_key(kind, value):
+    digest = hashlib.md5(str(value).encode()).hexdigest()
+    return f'posts:lookup:{kind}:{digest}'
+
+
+def remember_missing(kind, value):
+    cache.set(missing_key(kind, value), True, getattr(
+        settings, 'NEGATIVE_LOOKUP_TIMEOUT', NEGATIVE_LOOKUP_TIMEOUT
+    ))
+
+
+def bloom_enabled(kind):
+    return kind in BLOOM_KINDS and getattr(
+        settings, 'LOOKUP_BLOOM_FILTER', False
+    )
+
+
+def bloom_log_key(kind, number=None):
+    # Длина журнала и его записи; ключи posts:bloom: идут мимо L1
+    suffix = 'count' if number is None else number
+    return f'posts:bloom:{kind}:{suffix}'
+
+
+def rebuild_after():
+    return getattr(
+        settings, 'LOOKUP_BLOOM_REBUILD_AFTER', BLOOM_REBUILD_AFTER
+    )
+
+
+def bloom_filter(kind):
+    """Фильтр Блума вида kind с дописанными из журнала именами."""
+    generation, = generations(f'bloom:{kind}')
+    logged = cache.get(bloom_log_key(kind), 0)
+    built = _filters.get(kind)
+    if (
+        built is not None
+        and built['generation'] == generation
+        and built['expires'] > time.monotonic()
+        # Сброшенный журнал (вытеснен из кеша) начался бы заново
+        and built['seen'] <= logged
+        and logged - built['logged'] <= built['capacity']
+    ):
+        if logged <= built['seen']:
+            return built['bloom']
+        numbers = range(built['seen'] + 1, logged + 1)
+        added = cache.get_many([bloom_log_key(kind, n) for n in numbers])
+        if len(added) == len(numbers):
+            for value in added.values():
+                built['bloom'].add(value)
+            built['seen'] = logged
+            return built['bloom']
+    # Длину журнала берём до чтения таблицы: всё, что записано
+    # в журнал позже, фильтр дочитает из него
+    model, field = KINDS[kind]
+    values = list(model.objects.values_list(field, flat=True))
+    capacity = max(len(values) * 2, BLOOM_MIN_CAPACITY)
+    bloom = BloomFilter(capacity)
+    for value in values:
+        bloom.add(value)
+    _filters[kind] = {
+        'generation': generation,
+        'bloom': bloom,
+        'capacity': capacity - len(values),
+        'logged': logged,
+        'seen': logged,
+        'expires': time.monotonic() + rebuild_after(),
+    }
+    return bloom
+
+
+def object_added(kind, value, created=True):
+    """Снимает промах и пишет новое имя в журнал фильтров.
+
+    Промах или фильтр, построенные другим воркером до коммита, объекта
+    ещё не видят, поэтому всё повторяется после коммита.
+    """
+    repeat_on_commit(lambda: _object_added(kind, value, created))
+
+
+def _object_added(kind, value, created):
+    cache.delete(missing_key(kind, value))
+    if not bloom_enabled(kind):
+        return
+    if created or value not in bloom_filter(kind):
+        key = bloom_log_key(kind)
+        cache.add(key, 0, None)
+        number = cache.incr(key)
+        # Запись живёт дольше любого фильтра, который её не видел
+        cache.set(bloom_log_key(kind, number), value, rebuild_after() * 2)
+
+
+def known_missing(kind, value):
+    """True, если объекта точно нет и в базу можно не ходить."""
+    if bloom_enabled(kind) and value not in bloom_filter(kind):
+        return True
+    return cache.get(missing_key(kind, value)) is not None
+
+
+def lookup_stats():
+    """Попадания, промахи и доля попаданий кеша поиска в процессе."""
+    with _stats_lock:
+        report = {kind: dict(counts) for kind, counts in _stats.items()}
+    for counts in report.values():
+        total = counts['hits'] + counts['misses']
+        counts['hit_rate'] = counts['hits'] / total if total else 0.0
+    return report
+
+
+def _count(kind, hit):
+    with _stats_lock:
+        _stats[kind]['hits' if hit else 'misses'] += 1
+
+
+def cached_lookup(kind, value):
+    """Облегчённый экземпляр из кеша или базы; None, если его нет."""
+    key = lookup_key(kind, value)
+    instance = cache.get(key)
+    _count(kind, instance is not None)
+    if instance is not None:
+        remember(instance)
+        return instance
+    model, field = KINDS[kind]
+    queryset = model.objects.all()
+    if CACHED_FIELDS[kind] is not None:
+        queryset = queryset.only(*CACHED_FIELDS[kind])
+    instance = queryset.filter(**{field: value}).first()
+    if instance is not None:
+        cache.set(key, instance, getattr(
+            settings, 'LOOKUP_CACHE_TIMEOUT', LOOKUP_CACHE_TIMEOUT
+        ))
+    return instance
+
+
+def forget(kind, *values):
+    """Снимает закешированные экземпляры после записи или удаления."""
+    cache.delete_many([lookup_key(kind, value) for value in set(values)])
+
+
+def find(kind, value, queryset=None):
+    """Объект вида kind или None, с кешем промахов и находок.
+
+    Кеш находок используется только без своего queryset.
+    """
+    model, field = KINDS[kind]
+    if known_missing(kind, value):
+        return None
+    if queryset is None and kind in CACHED_FIELDS:
+        instance = cached_lookup(kind, value)
+    else:
+        if queryset is None:
+            queryset = model.objects.all()
+        instance = queryset.filter(**{field: value}).first()
+    if instance is None:
+        remember_missing(kind, value)
+    return instance
+
+
+def get_or_404(kind, value, queryset=None):
+    """Как get_object_or_404, но с кешем промахов и фильтром Блума."""
+    instance = find(kind, value, queryset)
+    if instance is None:
+        model = KINDS[kind][0]
+        raise Http404(f'{model._meta.object_name} не найден')
+    return instance
@@ -0,0 +1,50 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from posts.feeds import ENGINES
+from posts.models import User
+from posts.paginators import CountlessPaginator
+from posts.views import SHOW_SOME_POSTS
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает движки ленты подписок на данных текущей базы'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users', type=int, default=20,
+            help='Сколько подписчиков взять для замера'
+        )
+        parser.add_argument(
+            '--pages', type=int, default=3,
+            help='Сколько страниц ленты открыть каждому подписчику'
+        )
+
+    def handle(self, *args, **options):
+        users = list(
+            User.objects.filter(follower__isnull=False).distinct()
+            [:options['users']]
+        )
+        if not users:
+            self.stdout.write('В базе нет ни одной подписки')
+            return
+        for name, engine in ENGINES.items():
+            elapsed = 0
+            queries = 0
+            for user in users:
+                with CaptureQueriesContext(connection) as captured:
+                    start = time.perf_counter()
+                    paginator = CountlessPaginator(
+                        engine(user), SHOW_SOME_POSTS
+                    )
+                    for number in range(1, options['pages'] + 1):
+                        list(paginator.get_page(number))
+                    elapsed += time.perf_counter() - start
+                queries += len(captured)
+            self.stdout.write(
+                f'{name}: {elapsed * 1000 / len(users):.1f} мс и '
+                f'{queries / len(users):.1f} запросов на подписчика'
+            )
@@ -0,0 +1,29 @@
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+
+from posts.models import Post
+from posts.thumbnails import generate, thumbnail_key
+
+
+class Command(BaseCommand):
+    help = 'Строит недостающие варианты миниатюр картинок постов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Перестроить и уже готовые миниатюры'
+        )
+
+    def handle(self, *args, **options):
+        built = skipped = failed = 0
+        images = Post.objects.exclude(image='').values_list('pk', 'image')
+        for post_id, name in images.iterator():
+            if not options['force'] and cache.get(thumbnail_key(name)):
+                skipped += 1
+            elif generate(post_id):
+                built += 1
+            else:
+                failed += 1
+        self.stdout.write(
+            f'Построено: {built}, уже были: {skipped}, без файла: {failed}'
+        )
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from posts.models import Comment, Post
+from posts.rendering import render_comment, render_post, rerender_all
+
+
+class Command(BaseCommand):
+    help = 'Заново рендерит HTML текстов постов и комментариев'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Сколько строк обновлять одним запросом'
+        )
+
+    def handle(self, *args, **options):
+        size = options['batch_size']
+        posts = rerender_all(
+            Post, render_post, ['excerpt', 'text_html'], size)
+        comments = rerender_all(
+            Comment, render_comment, ['text_html'], size)
+        self.stdout.write(
+            f'Перерендерено постов: {posts}, комментариев: {comments}'
+        )
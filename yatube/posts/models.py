@@ -1,5 +1,9 @@
 from django.db import models
 from django.contrib.auth import get_user_model
+
+from .cache import bump, post_scopes
+from .images import IMAGE_FIELDS, describe_image
+from .rendering import render_comment, render_post
 # from django.db.models import UniqueConstraint
 # Нужно установить библиотеку pytils:
 # pip3 install pytils from pytils.translit import slugify
@@ -16,6 +20,11 @@ class Group(models.Model):
         max_length=200,
     )
     description = models.TextField(verbose_name='group_descrittion')
+    # Счётчик постов группы ведёт posts.counters
+    posts_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Постов в группе'
+    )
 
     def __str__(self) -> str:
         return self.title
@@ -29,6 +38,38 @@ class Group(models.Model):
         super().save(*args, **kwargs)
 
 
+class PostQuerySet(models.QuerySet):
+    # Поля, которые выводит карточка поста в лентах
+    FEED_FIELDS = (
+        'id', 'excerpt', 'pub_date', 'image', 'comments_count',
+        'image_width', 'image_height', 'image_color', 'image_placeholder',
+        'group', 'group__title', 'group__slug',
+        'author', 'author__username',
+        'author__first_name', 'author__last_name',
+    )
+
+    def feed(self):
+        """Посты для карточек ленты: одним запросом и без лишних колонок.
+
+        Автор и группа подтягиваются JOIN-ом, число комментариев
+        берётся из счётчика comments_count той же строки. Полный
+        текст не читаем: карточке хватает готового excerpt.
+        """
+        return self.select_related('author', 'group').only(
+            *self.FEED_FIELDS
+        )
+
+    def bulk_create(self, objs, *args, **kwargs):
+        # bulk_create не вызывает save() и сигналы: рендерим тексты
+        # и сдвигаем поколения кеша лент здесь
+        objs = list(objs)
+        for post in objs:
+            render_post(post)
+        created = super().bulk_create(objs, *args, **kwargs)
+        bump(*{scope for post in objs for scope in post_scopes(post)})
+        return created
+
+
 class Post(models.Model):
     text = models.TextField(
         verbose_name='post_text',
@@ -37,7 +78,6 @@ class Post(models.Model):
     pub_date = models.DateTimeField(
         auto_now_add=True,
         verbose_name='Дата',
-        # db_index=True
     )
     group = models.ForeignKey(
         Group,
@@ -58,15 +98,89 @@ class Post(models.Model):
         upload_to='posts/',
         blank=True
     )
+    # Готовый HTML текста, заполняется в save()
+    excerpt = models.TextField(
+        blank=True,
+        editable=False,
+        verbose_name='Начало поста'
+    )
+    text_html = models.TextField(
+        blank=True,
+        editable=False,
+        verbose_name='Текст поста в HTML'
+    )
+    # Счётчик комментариев поста ведёт posts.counters
+    comments_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Комментариев'
+    )
+    # Сведения о картинке, заполняются в save() при загрузке файла
+    image_width = models.PositiveIntegerField(
+        null=True,
+        editable=False,
+        verbose_name='Ширина картинки'
+    )
+    image_height = models.PositiveIntegerField(
+        null=True,
+        editable=False,
+        verbose_name='Высота картинки'
+    )
+    image_size = models.PositiveIntegerField(
+        null=True,
+        editable=False,
+        verbose_name='Размер картинки в байтах'
+    )
+    image_color = models.CharField(
+        max_length=7,
+        blank=True,
+        editable=False,
+        verbose_name='Основной цвет картинки'
+    )
+    image_placeholder = models.TextField(
+        blank=True,
+        editable=False,
+        verbose_name='Заглушка картинки'
+    )
+
+    objects = PostQuerySet.as_manager()
 
     class Meta:
         ordering = ['-pub_date']
         verbose_name = 'Пост'
         verbose_name_plural = 'Посты'
+        # Индексы повторяют порядок лент: общая, по автору, по группе
+        indexes = [
+            models.Index(
+                fields=['-pub_date', '-id'], name='post_pub_date_id'),
+            models.Index(
+                fields=['author', '-pub_date', '-id'],
+                name='post_author_pub_date'),
+            models.Index(
+                fields=['group', '-pub_date', '-id'],
+                name='post_group_pub_date'),
+        ]
 
     def __str__(self) -> str:
         return self.text[:15]
 
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'text' in update_fields:
+            render_post(self)
+            if update_fields is not None:
+                kwargs['update_fields'] = {
+                    *update_fields, 'excerpt', 'text_html'
+                }
+        update_fields = kwargs.get('update_fields')
+        # Новый файл ещё не записан в хранилище (_committed), а
+        # очищенное поле больше не описывает прежнюю картинку
+        if update_fields is None or 'image' in update_fields:
+            if not self.image or not self.image._committed:
+                describe_image(self)
+                if update_fields is not None:
+                    kwargs['update_fields'] = {*update_fields, *IMAGE_FIELDS}
+        super().save(*args, **kwargs)
+
 
 class Comment(models.Model):
     post = models.ForeignKey(
@@ -92,14 +206,30 @@ class Comment(models.Model):
         help_text='Дата публикации',
         auto_now_add=True
     )
+    # Готовый HTML текста, заполняется в save()
+    text_html = models.TextField(
+        blank=True,
+        editable=False,
+        verbose_name='Текст комментария в HTML'
+    )
 
     class Meta:
         ordering = ('-created',)
         verbose_name_plural = 'Комментарии к постам'
+        indexes = [models.Index(
+            fields=['post', '-created'], name='comment_post_created')]
 
     def __str__(self):
         return self.text
 
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'text' in update_fields:
+            render_comment(self)
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'text_html'}
+        super().save(*args, **kwargs)
+
 
 class Follow(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE,
@@ -110,3 +240,79 @@ class Follow(models.Model):
     class Meta:
         constraints = [models.UniqueConstraint(
             fields=['user', 'author'], name='unique_follow')]
+        # Пара (user, author) уже проиндексирована ограничением,
+        # подписчиков автора ищем по обратному индексу
+        indexes = [models.Index(
+            fields=['author', 'user'], name='follow_author_user')]
+
+
+class UserCounters(models.Model):
+    """Денормализованные счётчики пользователя.
+
+    Ведутся posts.counters при создании и удалении постов и подписок;
+    пересчитываются командой rebuild_counters.
+    """
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='counters',
+        verbose_name='Пользователь'
+    )
+    posts_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Постов'
+    )
+    followers_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Подписчиков'
+    )
+    following_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Подписок'
+    )
+
+    class Meta:
+        verbose_name = 'Счётчики пользователя'
+        verbose_name_plural = 'Счётчики пользователей'
+
+    def __str__(self):
+        return str(self.user_id)
+
+
+class TimelineEntry(models.Model):
+    """Пост в материализованной ленте подписок пользователя.
+
+    Строки пишутся при публикации поста (fan-out on write), а также
+    при подписке и отписке; см. posts.timelines.
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='timeline',
+        verbose_name='Подписчик'
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='timeline_entries',
+        verbose_name='Пост'
+    )
+    # Автор и дата дублируют пост: по ним чистим и сортируем ленту
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Автор поста'
+    )
+    pub_date = models.DateTimeField(verbose_name='Дата')
+
+    class Meta:
+        ordering = ['-pub_date']
+        verbose_name = 'Запись ленты подписок'
+        verbose_name_plural = 'Ленты подписок'
+        constraints = [models.UniqueConstraint(
+            fields=['user', 'post'], name='unique_timeline_entry')]
+        indexes = [models.Index(
+            fields=['user', '-pub_date', '-post'],
+            name='timeline_user_pub_date_post')]
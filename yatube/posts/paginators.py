@@ -0,0 +1,286 @@
+"""Пагинаторы лент постов.
+
+Обычный Paginator считает COUNT(*) и листает через OFFSET, поэтому
+дальние страницы открываются тем дольше, чем глубже страница.
+CursorPaginator ищет страницу по ключу (pub_date, id) и отдаёт
+непрозрачные токены ?cursor=, время ответа от глубины не зависит.
+EstimatedCountPaginator и CountlessPaginator оставляют номера страниц,
+но обходятся оценкой количества или вовсе без него.
+"""
+import base64
+import binascii
+import json
+from math import ceil
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.paginator import EmptyPage, Page, Paginator
+from django.db import connection
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+# Направление перехода, зашитое в токен курсора
+NEXT = 'n'
+PREVIOUS = 'p'
+
+# Наибольшее целое, которое примет база (bigint): id в курсоре
+# и OFFSET нумерованной страницы
+MAX_INT = 2 ** 63 - 1
+
+# Пропуск в свёрнутом списке номеров страниц
+ELLIPSIS = '…'
+
+
+def encode_cursor(direction, post):
+    """Упаковывает позицию поста в токен для ?cursor=."""
+    raw = json.dumps([direction, post.pub_date.isoformat(), post.pk])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Возвращает (направление, pub_date, id) или None для битого токена."""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        direction, pub_date, pk = json.loads(
+            base64.urlsafe_b64decode(padded.encode())
+        )
+        pub_date = parse_datetime(pub_date)
+    except (TypeError, ValueError, binascii.Error):
+        return None
+    if (
+        direction not in (NEXT, PREVIOUS)
+        or pub_date is None
+        # Наивное время нельзя сравнить с pub_date из базы
+        or timezone.is_naive(pub_date)
+        # bool - тоже int, а id вне диапазона база не сравнит
+        or isinstance(pk, bool)
+        or not isinstance(pk, int)
+        or not 1 <= pk <= MAX_INT
+    ):
+        return None
+    return direction, pub_date, pk
+
+
+class CursorPaginator(Paginator):
+    """Keyset-пагинация по (pub_date, id) без COUNT(*) и OFFSET."""
+    ordering = ('-pub_date', '-id')
+
+    def get_page(self, cursor):
+        # Битый или устаревший токен ведёт на первую страницу,
+        # так же как Paginator.get_page с неправильным номером
+        position = decode_cursor(cursor) if cursor else None
+        return CursorPage(self, position)
+
+    def seek(self, position, limit):
+        """Возвращает до limit постов за позицией курсора."""
+        if hasattr(self.object_list, 'seek'):
+            # Ленты не из QuerySet (например, MergedFeed) ищут сами
+            return self.object_list.seek(position, limit)
+        posts = self.object_list.order_by(*self.ordering)
+        if position is None:
+            return list(posts[:limit])
+        direction, pub_date, pk = position
+        if direction == NEXT:
+            posts = posts.filter(
+                Q(pub_date__lt=pub_date) | Q(pub_date=pub_date, id__lt=pk)
+            )
+        else:
+            posts = posts.filter(
+                Q(pub_date__gt=pub_date) | Q(pub_date=pub_date, id__gt=pk)
+            ).order_by('pub_date', 'id')
+        return list(posts[:limit])
+
+
+class CursorPage(Page):
+    """Страница курсорной ленты, совместимая с шаблонами Page.
+
+    Номера страницы и общего количества у неё нет: вместо
+    next_page_number и previous_page_number шаблон берёт
+    next_cursor и previous_cursor.
+    """
+    is_cursor = True
+
+    def __init__(self, paginator, position):
+        self.paginator = paginator
+        self.position = position
+        self.number = None
+
+    def __repr__(self):
+        return '<Page cursor>'
+
+    @property
+    def backward(self):
+        return self.position is not None and self.position[0] == PREVIOUS
+
+    @cached_property
+    def _window(self):
+        # Берём на один пост больше, чтобы узнать, есть ли ещё страница
+        per_page = self.paginator.per_page
+        posts = self.paginator.seek(self.position, per_page + 1)
+        has_more = len(posts) > per_page
+        posts = posts[:per_page]
+        if self.backward:
+            posts.reverse()
+        return posts, has_more
+
+    @property
+    def object_list(self):
+        return self._window[0]
+
+    def has_next(self):
+        if not self.object_list:
+            return False
+        return self.backward or self._window[1]
+
+    def has_previous(self):
+        if self.backward:
+            return self._window[1]
+        return self.position is not None
+
+    @property
+    def next_cursor(self):
+        if self.has_next():
+            return encode_cursor(NEXT, self.object_list[-1])
+        return None
+
+    @property
+    def previous_cursor(self):
+        if self.has_previous() and self.object_list:
+            return encode_cursor(PREVIOUS, self.object_list[0])
+        return None
+
+
+def estimate_count(queryset):
+    """Оценивает количество строк запроса без COUNT(*).
+
+    На PostgreSQL берём оценку планировщика из EXPLAIN, на остальных
+    базах честно считаем: там таблицы маленькие.
+    """
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class CountlessPaginator(Paginator):
+    """Нумерованные страницы совсем без подсчёта постов.
+
+    О следующей странице узнаём по одному лишнему посту в выборке,
+    поэтому последняя известная страница - текущая или следующая.
+    """
+    is_countless = True
+
+    def validate_number(self, number):
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            return 1
+        if number * self.per_page >= MAX_INT:
+            # OFFSET такой страницы база не примет
+            raise EmptyPage('Такой страницы нет')
+        return max(number, 1)
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        posts = list(self.object_list[bottom:bottom + self.per_page + 1])
+        if not posts and number > 1:
+            raise EmptyPage('Такой страницы нет')
+        if len(posts) > self.per_page:
+            self.num_pages = self.last_page_after(number)
+        else:
+            self.num_pages = number
+        return self._get_page(posts[:self.per_page], number, self)
+
+    def last_page_after(self, number):
+        """Номер последней страницы, если за number есть ещё посты."""
+        return number + 1
+
+    def get_page(self, number):
+        try:
+            return self.page(number)
+        except EmptyPage:
+            return self.page(1)
+
+
+class EstimatedCountPaginator(CountlessPaginator):
+    """Нумерованные страницы по оценке количества вместо COUNT(*).
+
+    Оценку можно передать готовой (например, из счётчика); иначе
+    её даёт estimate_count. Оценка нужна только для ссылок на
+    страницы: есть ли следующая, решает лишний пост в выборке.
+    """
+    is_countless = False
+
+    def __init__(self, object_list, per_page, estimate=None, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.estimate = estimate
+
+    @cached_property
+    def count(self):
+        if self.estimate is not None:
+            return self.estimate
+        return estimate_count(self.object_list)
+
+    def last_page_after(self, number):
+        return max(number + 1, ceil(self.count / self.per_page))
+
+
+PAGINATORS = {
+    'page': Paginator,
+    'estimate': EstimatedCountPaginator,
+    'countless': CountlessPaginator,
+}
+
+
+def elided_page_range(number, num_pages, on_each_side=2, on_ends=1):
+    """Номера страниц вокруг текущей с пропусками ELLIPSIS.
+
+    Повторяет Paginator.get_elided_page_range из Django 3.2.
+    """
+    if num_pages <= (on_each_side + on_ends) * 2:
+        return list(range(1, num_pages + 1))
+    pages = []
+    if number > 1 + on_each_side + on_ends + 1:
+        pages += list(range(1, on_ends + 1)) + [ELLIPSIS]
+        pages += list(range(number - on_each_side, number + 1))
+    else:
+        pages += list(range(1, number + 1))
+    if number < num_pages - on_each_side - on_ends - 1:
+        pages += list(range(number + 1, number + on_each_side + 1))
+        pages += [ELLIPSIS]
+        pages += list(range(num_pages - on_ends + 1, num_pages + 1))
+    else:
+        pages += list(range(number + 1, num_pages + 1))
+    return pages
+
+
+def paginate(request, object_list, per_page, mode='page', count=None):
+    """Выбирает пагинатор для ленты по режиму из настроек.
+
+    Явный ?cursor= всегда включает курсор, а явный ?page=
+    оставляет нумерованную страницу, чтобы старые ссылки работали.
+    count - готовая оценка количества для режима 'estimate'.
+    """
+    cursor = request.GET.get('cursor')
+    if cursor is not None or (
+        mode == 'cursor' and 'page' not in request.GET
+    ):
+        return CursorPaginator(object_list, per_page).get_page(cursor)
+    if mode == 'cursor':
+        mode = 'page'
+    if mode not in PAGINATORS:
+        raise ImproperlyConfigured(
+            f'Неизвестный режим пагинации ленты: {mode!r}'
+        )
+    if mode == 'estimate':
+        paginator = EstimatedCountPaginator(object_list, per_page, count)
+    else:
+        paginator = PAGINATORS[mode](object_list, per_page)
+    return paginator.get_page(request.GET.get('page'))
@@ -0,0 +1,52 @@
+"""Готовые HTML-фрагменты текстов постов и комментариев.
+
+Тексты рендерятся один раз при записи, а шаблоны выводят
+сохранённый результат и не гоняют truncatewords и linebreaksbr
+на каждом показе страницы.
+"""
+from django.template.defaultfilters import linebreaksbr
+from django.utils.html import escape
+from django.utils.text import Truncator
+
+# Сколько слов поста попадает в карточку ленты
+EXCERPT_WORDS = 30
+
+
+def render_text(text):
+    """Текст с экранированием и переносами строк через <br>."""
+    return linebreaksbr(text, autoescape=True)
+
+
+def render_excerpt(text):
+    """Начало текста для карточки, как truncatewords:30."""
+    return escape(Truncator(text).words(EXCERPT_WORDS))
+
+
+def render_post(post):
+    post.excerpt = render_excerpt(post.text)
+    post.text_html = render_text(post.text)
+
+
+def render_comment(comment):
+    comment.text_html = render_text(comment.text)
+
+
+def rerender_all(model, render, fields, batch_size=500):
+    """Перерендеривает тексты всех строк model пачками по batch_size.
+
+    Модель передаётся снаружи, чтобы миграция могла отдать
+    историческую. Возвращает число обновлённых строк.
+    """
+    total = 0
+    batch = []
+    for obj in model.objects.only('pk', 'text').iterator():
+        render(obj)
+        batch.append(obj)
+        if len(batch) == batch_size:
+            model.objects.bulk_update(batch, fields)
+            total += len(batch)
+            batch = []
+    if batch:
+        model.objects.bulk_update(batch, fields)
+        total += len(batch)
+    return total
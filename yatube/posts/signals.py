@@ -0,0 +1,177 @@
+from django.db.models.signals import (
+    post_delete, post_init, post_save, pre_delete, pre_save,
+)
+from django.dispatch import receiver
+
+from . import cache, counters, feeds, lookups, thumbnails, timelines
+from .models import Comment, Follow, Group, Post, User, UserCounters
+
+# Вид поиска из URL (posts.lookups) для кеша находок
+LOOKUP_KINDS = {User: 'user', Group: 'group'}
+
+
+@receiver(post_save, sender=User)
+def create_user_counters(sender, instance, created, **kwargs):
+    if created:
+        UserCounters.objects.get_or_create(user=instance)
+
+
+@receiver(pre_save, sender=Post)
+def remember_post_group(sender, instance, **kwargs):
+    # Группу до правки запоминаем, чтобы перенести счётчик постов
+    instance._previous_group_id = None
+    if instance.pk is not None:
+        instance._previous_group_id = Post.objects.filter(
+            pk=instance.pk
+        ).values_list('group_id', flat=True).first()
+
+
+@receiver(post_save, sender=Post)
+def count_post(sender, instance, created, **kwargs):
+    if created:
+        counters.post_added(instance)
+    elif instance._previous_group_id != instance.group_id:
+        counters.post_moved(instance._previous_group_id, instance.group_id)
+
+
+@receiver(post_delete, sender=Post)
+def uncount_post(sender, instance, **kwargs):
+    counters.post_added(instance, delta=-1)
+
+
+@receiver(post_save, sender=Comment)
+def count_comment(sender, instance, created, **kwargs):
+    if created:
+        counters.comment_added(instance)
+
+
+@receiver(post_delete, sender=Comment)
+def uncount_comment(sender, instance, **kwargs):
+    counters.comment_added(instance, delta=-1)
+
+
+@receiver(post_save, sender=Follow)
+def count_follow(sender, instance, created, **kwargs):
+    if created:
+        counters.follow_added(instance)
+
+
+@receiver(post_delete, sender=Follow)
+def uncount_follow(sender, instance, **kwargs):
+    counters.follow_added(instance, delta=-1)
+
+
+@receiver(post_save, sender=Post)
+def fan_out_post(sender, instance, created, **kwargs):
+    if created:
+        timelines.fan_out(instance)
+        feeds.forget_recent_posts(instance.author_id)
+
+
+@receiver(post_delete, sender=Post)
+def forget_deleted_post(sender, instance, **kwargs):
+    feeds.forget_recent_posts(instance.author_id)
+
+
+@receiver(post_save, sender=Follow)
+def backfill_timeline(sender, instance, created, **kwargs):
+    if created:
+        timelines.backfill(instance)
+
+
+@receiver(post_delete, sender=Follow)
+def prune_timeline(sender, instance, **kwargs):
+    timelines.prune(instance)
+
+
+@receiver(post_save, sender=Post)
+def invalidate_post_feeds(sender, instance, created, **kwargs):
+    cache.bump_on_commit(
+        *cache.post_scopes(instance, instance._previous_group_id))
+
+
+@receiver(post_delete, sender=Post)
+def invalidate_deleted_post_feeds(sender, instance, **kwargs):
+    cache.bump_on_commit(*cache.post_scopes(instance))
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_comment_feeds(sender, instance, **kwargs):
+    cache.bump_on_commit(*cache.post_scopes(instance.post))
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def invalidate_follow_feed(sender, instance, **kwargs):
+    cache.bump_on_commit(
+        f'follow:{instance.user_id}', f'followers:{instance.author_id}',
+        'follows',
+    )
+
+
+# Имя автора и группа показаны в карточках всех лент с их постами
+
+@receiver(post_save, sender=User)
+def invalidate_user_feeds(sender, instance, created, update_fields,
+                          **kwargs):
+    # Вход пользователя сохраняет только last_login
+    if created or update_fields == frozenset(['last_login']):
+        return
+    cache.bump_on_commit(*cache.user_scopes(instance))
+
+
+@receiver(post_save, sender=Group)
+def invalidate_group_feeds(sender, instance, created, **kwargs):
+    if not created:
+        cache.bump_on_commit(*cache.group_scopes(instance))
+
+
+@receiver(pre_delete, sender=Group)
+def invalidate_deleted_group_feeds(sender, instance, **kwargs):
+    # После удаления посты группы уже отвязаны от неё
+    cache.bump_on_commit(*cache.group_scopes(instance))
+
+
+@receiver(post_save, sender=User)
+def found_user(sender, instance, created, **kwargs):
+    lookups.object_added('user', instance.username, created)
+
+
+@receiver(post_save, sender=Group)
+def found_group(sender, instance, created, **kwargs):
+    lookups.object_added('group', instance.slug, created)
+
+
+@receiver(post_save, sender=Post)
+def found_post(sender, instance, created, **kwargs):
+    if created:
+        lookups.object_added('post', instance.pk)
+
+
+@receiver(post_save, sender=Post)
+def prepare_thumbnail(sender, instance, **kwargs):
+    thumbnails.prepare(instance)
+
+
+# Кеш находок (posts.lookups) хранит экземпляр под именем или
+# слагом. Значение при загрузке запоминаем, чтобы после
+# переименования снять и запись под старым
+
+@receiver(post_init, sender=User)
+@receiver(post_init, sender=Group)
+def remember_lookup_value(sender, instance, **kwargs):
+    field = lookups.KINDS[LOOKUP_KINDS[sender]][1]
+    instance._lookup_value = instance.__dict__.get(field)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def forget_cached_lookup(sender, instance, **kwargs):
+    kind = LOOKUP_KINDS[sender]
+    field = lookups.KINDS[kind][1]
+    values = instance._lookup_value, getattr(instance, field)
+    cache.repeat_on_commit(lambda: lookups.forget(kind, *values))
+    instance._lookup_value = values[1]
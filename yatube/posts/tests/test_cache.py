@@ -0,0 +1,142 @@
+import time
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache, caches
+from django.test import SimpleTestCase, TestCase
+
+from core.cache import TwoLevelCache, get_or_refresh
+from posts.cache import generations
+from posts.models import Post
+from posts.tests.utils import run_commit_callbacks
+
+User = get_user_model()
+
+
+class TwoLevelCacheTest(SimpleTestCase):
+    def setUp(self):
+        self.shared = caches['shared']
+        self.shared.clear()
+        self.cache = TwoLevelCache('shared', {
+            'OPTIONS': {
+                'L1_MAX_ENTRIES': 2,
+                'L1_TIMEOUT': 5,
+                'L1_BYPASS': ['posts:gen:'],
+            },
+        })
+
+    def test_second_read_served_by_l1(self):
+        self.cache.set('card', 'html')
+        self.assertEqual(self.cache.get('card'), 'html')
+        self.shared.delete('card')
+        self.assertEqual(self.cache.get('card'), 'html')
+        self.assertEqual(
+            self.cache.stats(),
+            {'l1': {'hits': 2, 'misses': 0}, 'l2': {'hits': 0, 'misses': 0}}
+        )
+
+    def test_l1_copy_expires(self):
+        self.cache.set('card', 'old')
+        self.shared.set('card', 'new')
+        with mock.patch('core.cache.time.monotonic', return_value=10 ** 9):
+            self.assertEqual(self.cache.get('card'), 'new')
+        self.assertEqual(self.cache.stats()['l2'], {'hits': 1, 'misses': 0})
+
+    def test_generation_keys_bypass_l1(self):
+        """Сдвиг поколения в другом воркере виден сразу"""
+        self.cache.set('posts:gen:all', 1)
+        self.shared.incr('posts:gen:all')
+        self.assertEqual(self.cache.get('posts:gen:all'), 2)
+        self.assertEqual(self.cache.get_many(['posts:gen:all']), {
+            'posts:gen:all': 2
+        })
+        self.assertEqual(self.cache.stats()['l1'], {'hits': 0, 'misses': 0})
+
+    def test_least_recently_used_evicted(self):
+        self.cache.set_many({'a': 1, 'b': 2})
+        self.cache.get('a')
+        self.cache.set('c', 3)
+        self.shared.clear()
+        self.assertEqual(
+            self.cache.get_many(['a', 'b', 'c']), {'a': 1, 'c': 3}
+        )
+
+    def test_get_shared_skips_l1_copy(self):
+        self.cache.set('card', 'old')
+        self.shared.set('card', 'new')
+        self.assertEqual(self.cache.get_shared('card'), 'new')
+        self.assertEqual(self.cache.get('card'), 'new')
+
+    def test_incr_and_delete_reach_l2(self):
+        self.cache.set('n', 1)
+        self.assertEqual(self.cache.incr('n'), 2)
+        self.assertEqual(self.cache.get('n'), 2)
+        self.cache.delete('n')
+        self.assertIsNone(self.shared.get('n'))
+        self.assertIsNone(self.cache.get('n'))
+
+
+class GetOrRefreshTest(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+
+    def compute(self):
+        self.calls += 1
+        return f'страница {self.calls}'
+
+    def test_value_computed_once(self):
+        for _ in range(3):
+            value = get_or_refresh('page', self.compute, 60, version=1)
+        self.assertEqual(value, 'страница 1')
+        self.assertEqual(self.calls, 1)
+
+    def test_new_version_recomputed(self):
+        get_or_refresh('page', self.compute, 60, version=1)
+        value = get_or_refresh('page', self.compute, 60, version=2)
+        self.assertEqual(value, 'страница 2')
+
+    def test_stale_value_while_other_worker_recomputes(self):
+        get_or_refresh('page', self.compute, 60, version=1)
+        cache.add('page:lock', 1)
+        value = get_or_refresh('page', self.compute, 60, version=2)
+        self.assertEqual(value, 'страница 1')
+        self.assertEqual(self.calls, 1)
+
+    def test_new_version_read_from_l2(self):
+        """Версию, пересчитанную другим воркером, не считаем заново"""
+        get_or_refresh('page', self.compute, 60, version=1)
+        caches['shared'].set(
+            'page', ('страница другого воркера', 0, time.time() + 60, 2))
+        value = get_or_refresh('page', self.compute, 60, version=2)
+        self.assertEqual(value, 'страница другого воркера')
+        self.assertEqual(self.calls, 1)
+
+    def test_lock_lives_a_few_compute_times(self):
+        cache.set('page', ('старая', 2, time.time() + 60, 1))
+        with mock.patch.object(cache, 'add', return_value=False) as add:
+            get_or_refresh('page', self.compute, 3600, version=2)
+        add.assert_called_once_with('page:lock', 1, 6)
+
+    def test_early_refresh_near_expiry(self):
+        """Долгий пересчёт у конца срока запускается заранее"""
+        cache.set('page', ('старая', 100, time.time() + 1, None))
+        with mock.patch('core.cache.random.random', return_value=0.5):
+            value = get_or_refresh('page', self.compute, 60)
+        self.assertEqual(value, 'страница 1')
+        cache.set('page', ('старая', 0.001, time.time() + 30, None))
+        with mock.patch('core.cache.random.random', return_value=0.5):
+            value = get_or_refresh('page', self.compute, 60)
+        self.assertEqual(value, 'старая')
+
+
+class BumpOnCommitTest(TestCase):
+    def test_generation_bumped_again_after_commit(self):
+        """Страница, закешированная до коммита, устаревает после него"""
+        author = User.objects.create_user(username='committer')
+        Post.objects.create(author=author, text='Пост')
+        scopes = ('all', f'author:{author.pk}')
+        before = generations(*scopes)
+        run_commit_callbacks()
+        for old, new in zip(before, generations(*scopes)):
+            self.assertNotEqual(old, new)
@@ -1,9 +1,19 @@
-from django.test import TestCase, Client
+import shutil
+import tempfile
+from io import BytesIO
+
+from PIL import Image
+
+from django import forms
+from django.test import TestCase, Client, RequestFactory, override_settings
 from django.urls import reverse
 from django.contrib.auth import get_user_model
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.uploadhandler import StopUpload
+from django.template.defaultfilters import filesizeformat
 
 from posts.forms import PostForm
+from posts.images import LimitedUploadHandler, request_files
 from posts.models import Group, Post
 
 User = get_user_model()
@@ -118,3 +128,108 @@ class TestCreateForm(TestCase):
             reverse('posts:group_list', args=(self.group.slug,)))
         self.assertEqual(
             old_group_response.context['page_obj'].paginator.count, 0)
+
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp()
+
+
+# Пул миниатюр писал бы в MEDIA_ROOT, пока тест его удаляет
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, THUMBNAIL_WORKERS=0)
+class UploadLimitsTest(TestCase):
+    """Загрузка картинки проверяется и пересобирается до записи"""
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='uploader')
+        self.client.force_login(self.user)
+
+    def photo(self, size=(400, 200)):
+        exif = Image.Exif()
+        exif[0x010F] = 'Камера'
+        buffer = BytesIO()
+        Image.new('RGB', size, (200, 30, 30)).save(
+            buffer, 'JPEG', exif=exif.tobytes())
+        return SimpleUploadedFile('photo.jpg', buffer.getvalue(), 'image/jpeg')
+
+    def upload(self, image):
+        return self.client.post(
+            reverse('posts:create_post'), {'text': 'Фото', 'image': image})
+
+    @override_settings(IMAGE_MAX_BYTES=100)
+    def test_heavy_file_rejected_by_size(self):
+        response = self.upload(self.photo())
+        self.assertFormError(
+            response, 'form', 'image', f'Файл больше {filesizeformat(100)}')
+        self.assertFalse(Post.objects.exists())
+
+    @override_settings(IMAGE_MAX_PIXELS=1000)
+    def test_large_image_rejected_before_decoding(self):
+        response = self.upload(self.photo())
+        self.assertFormError(
+            response, 'form', 'image', 'Картинка больше 0.001 мегапикселей')
+        self.assertFalse(Post.objects.exists())
+
+    @override_settings(IMAGE_MAX_SIDE=100)
+    def test_upload_downscaled_without_exif(self):
+        self.upload(self.photo())
+        post = Post.objects.get()
+        self.assertEqual((post.image_width, post.image_height), (100, 50))
+        with Image.open(post.image.path) as image:
+            self.assertEqual(image.size, (100, 50))
+            self.assertEqual(len(image.getexif()), 0)
+
+    @override_settings(IMAGE_MAX_PIXELS=10 ** 6, IMAGE_MAX_FULL_PIXELS=1000)
+    def test_png_held_to_full_decode_limit(self):
+        """PNG декодируется целиком, и его предел ниже, чем у JPEG"""
+        buffer = BytesIO()
+        Image.new('RGB', (400, 200)).save(buffer, 'PNG')
+        response = self.upload(SimpleUploadedFile(
+            'picture.png', buffer.getvalue(), 'image/png'))
+        self.assertFormError(
+            response, 'form', 'image', 'Картинка больше 0.001 мегапикселей')
+        self.upload(self.photo())
+        self.assertEqual(Post.objects.count(), 1)
+
+    @override_settings(IMAGE_MAX_BYTES=100)
+    def test_upload_stopped_past_size_limit(self):
+        """Остаток тяжёлого файла не читается"""
+        request = RequestFactory().post('/')
+        handler = LimitedUploadHandler(request)
+        handler.new_file('image', 'photo.jpg', 'image/jpeg', 1000)
+        handler.receive_data_chunk(b'x' * 64, 0)
+        with self.assertRaises(StopUpload) as stop:
+            handler.receive_data_chunk(b'x' * 64, 64)
+        self.assertTrue(stop.exception.connection_reset)
+        self.assertEqual(request_files(request)['image'].size, 128)
+
+    def test_truncated_image_rejected(self):
+        """Обрезанный JPEG проходит verify, но не декодируется"""
+        data = self.photo().read()
+        response = self.upload(SimpleUploadedFile(
+            'photo.jpg', data[:len(data) // 2], 'image/jpeg'))
+        self.assertEqual(response.status_code, 200)
+        self.assertFormError(
+            response, 'form', 'image',
+            forms.ImageField.default_error_messages['invalid_image'])
+        self.assertFalse(Post.objects.exists())
+
+    @override_settings(IMAGE_MAX_SIDE=100)
+    def test_other_formats_saved_as_jpeg_or_png(self):
+        for mode, image_format, suffix in (
+            ('RGB', 'JPEG', '.jpg'), ('RGBA', 'PNG', '.png'),
+        ):
+            with self.subTest(mode=mode):
+                buffer = BytesIO()
+                Image.new(mode, (400, 200)).save(
+                    buffer, 'TIFF', tiffinfo={0x010F: 'Camera'})
+                self.upload(SimpleUploadedFile(
+                    'scan.tiff', buffer.getvalue(), 'image/tiff'))
+                post = Post.objects.latest('pk')
+                self.assertTrue(post.image.name.endswith(suffix))
+                with Image.open(post.image.path) as image:
+                    self.assertEqual(image.format, image_format)
+                    self.assertEqual(image.size, (100, 50))
+                    self.assertEqual(len(image.getexif()), 0)
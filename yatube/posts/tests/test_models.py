@@ -1,7 +1,11 @@
+from io import StringIO
+
+from django.core.management import call_command
 from django.test import TestCase
+from django.urls import reverse
 from django.contrib.auth import get_user_model
 
-from posts.models import Group, Post
+from posts.models import Comment, Follow, Group, Post, UserCounters
 
 User = get_user_model()
 
@@ -50,3 +54,138 @@ class PostModelTest(TestCase):
         post = PostModelTest.post
         help_text = post._meta.get_field('text').help_text
         self.assertEqual(help_text, 'Текст поста')
+
+
+class PostQuerySetTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(
+            username='feed', first_name='Лев', last_name='Толстой')
+        group = Group.objects.create(title='Группа', slug='feed')
+        for i in range(3):
+            Post.objects.create(author=author, group=group, text=str(i))
+
+    def test_feed_loads_cards_in_one_query(self):
+        """Поля карточки ленты приходят одним запросом"""
+        with self.assertNumQueries(1):
+            for post in Post.objects.feed():
+                (
+                    post.excerpt, post.pub_date, post.image,
+                    post.comments_count, post.group.slug,
+                    post.author.get_full_name(), post.author.username,
+                )
+
+
+class RenderedTextTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='writer')
+
+    def test_post_text_rendered_on_save(self):
+        """Пост хранит экранированный HTML и начало текста"""
+        post = Post.objects.create(
+            author=self.author, text='<b>раз</b>\n' + 'слово ' * 40)
+        self.assertTrue(
+            post.text_html.startswith('&lt;b&gt;раз&lt;/b&gt;<br>'))
+        self.assertEqual(len(post.excerpt.split()), 30)
+        self.assertTrue(post.excerpt.endswith('…'))
+        post.text = 'новый\nтекст'
+        post.save(update_fields=['text'])
+        post.refresh_from_db()
+        self.assertEqual(post.text_html, 'новый<br>текст')
+        self.assertEqual(post.excerpt, 'новый текст')
+
+    def test_bulk_created_posts_rendered(self):
+        Post.objects.bulk_create([Post(author=self.author, text='a\nb')])
+        self.assertEqual(Post.objects.get().text_html, 'a<br>b')
+
+    def test_comment_text_rendered_on_save(self):
+        post = Post.objects.create(author=self.author, text='пост')
+        comment = Comment.objects.create(
+            post=post, author=self.author, text='<i>\n')
+        self.assertEqual(comment.text_html, '&lt;i&gt;<br>')
+
+    def test_render_texts_command(self):
+        post = Post.objects.create(author=self.author, text='a\nb')
+        Post.objects.filter(pk=post.pk).update(excerpt='', text_html='')
+        call_command('render_texts', stdout=StringIO())
+        post.refresh_from_db()
+        self.assertEqual(post.excerpt, 'a b')
+        self.assertEqual(post.text_html, 'a<br>b')
+
+
+class CountersTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='counted')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(title='Группа', slug='counted')
+        cls.other_group = Group.objects.create(title='Другая', slug='other')
+
+    def counters(self, user):
+        return UserCounters.objects.get(user=user)
+
+    def test_post_counters(self):
+        """Счётчики постов автора и группы следуют за постами"""
+        post = Post.objects.create(
+            author=self.author, group=self.group, text='Пост')
+        self.assertEqual(self.counters(self.author).posts_count, 1)
+        self.group.refresh_from_db()
+        self.assertEqual(self.group.posts_count, 1)
+        post.group = self.other_group
+        post.save()
+        self.group.refresh_from_db()
+        self.other_group.refresh_from_db()
+        self.assertEqual(self.group.posts_count, 0)
+        self.assertEqual(self.other_group.posts_count, 1)
+        post.delete()
+        self.assertEqual(self.counters(self.author).posts_count, 0)
+        self.other_group.refresh_from_db()
+        self.assertEqual(self.other_group.posts_count, 0)
+
+    def test_comment_and_follow_counters(self):
+        """Счётчики комментариев и подписок следуют за записями"""
+        post = Post.objects.create(author=self.author, text='Пост')
+        comment = Comment.objects.create(
+            post=post, author=self.reader, text='Комментарий')
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+        comment.delete()
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 0)
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.assertEqual(self.counters(self.author).followers_count, 1)
+        self.assertEqual(self.counters(self.reader).following_count, 1)
+        Follow.objects.filter(user=self.reader).delete()
+        self.assertEqual(self.counters(self.author).followers_count, 0)
+        self.assertEqual(self.counters(self.reader).following_count, 0)
+
+    def test_pages_of_user_without_counters(self):
+        """Строку счётчиков, которой нет, страницы создают по таблицам"""
+        post = Post.objects.create(author=self.author, text='Пост')
+        Follow.objects.create(user=self.reader, author=self.author)
+        UserCounters.objects.filter(user=self.author).delete()
+        urls = [
+            reverse('posts:profile', kwargs={'username': 'counted'}),
+            reverse('posts:post_detail', kwargs={'post_id': post.pk}),
+        ]
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, 200)
+        counters = self.counters(self.author)
+        self.assertEqual(
+            (counters.posts_count, counters.followers_count), (1, 1))
+
+    def test_rebuild_counters_fixes_drift(self):
+        """rebuild_counters пересчитывает разошедшиеся счётчики"""
+        # bulk_create обходит сигналы, счётчики отстают
+        Post.objects.bulk_create(
+            Post(author=self.author, group=self.group, text=str(i))
+            for i in range(3)
+        )
+        UserCounters.objects.filter(user=self.reader).delete()
+        call_command('rebuild_counters', stdout=open('/dev/null', 'w'))
+        self.assertEqual(self.counters(self.author).posts_count, 3)
+        self.assertEqual(self.counters(self.reader).posts_count, 0)
+        self.group.refresh_from_db()
+        self.assertEqual(self.group.posts_count, 3)
@@ -0,0 +1,202 @@
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.contrib.auth import get_user_model
+
+from core.identity import identity_map
+from posts import lookups, urls
+from posts.models import Comment, Follow, Group, Post
+from posts.tests.utils import run_commit_callbacks, without_page_cache
+from users.backends import user_key
+
+User = get_user_model()
+
+# Бюджет SQL-запросов каждой страницы posts/urls.py для вошедшего
+# пользователя, а у страниц с ETag - и с запросом ключа для него.
+# Сессия и пользователь берутся из кеша (users.backends), поэтому
+# загрузку пользователя из базы несёт только первая страница.
+# Новый URL без бюджета тоже роняет тесты
+QUERY_BUDGETS = {
+    'index': 2,
+    'create_post': 1,
+    'group_list': 2,
+    'profile': 4,
+    'post_detail': 3,
+    'post_edit': 2,
+    'add_comment': 3,
+    'follow_index': 2,
+    'profile_follow': 9,
+    'profile_unfollow': 6,
+}
+
+
+class QueryBudgetTests(TestCase):
+    """Число запросов страницы не растёт вместе с числом постов"""
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='budget_author')
+        cls.reader = User.objects.create_user(username='budget_reader')
+        cls.group = Group.objects.create(title='Группа', slug='budget')
+        for i in range(15):
+            cls.post = Post.objects.create(
+                author=cls.author, group=cls.group, text=f'Пост {i}')
+            Comment.objects.create(
+                post=cls.post, author=cls.reader, text='Комментарий')
+        Follow.objects.create(user=cls.reader, author=cls.author)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.author)
+
+    def request(self, name):
+        """Запрос к странице name с подходящими аргументами."""
+        post_id = {'post_id': self.post.pk}
+        requests = {
+            'index': ('get', reverse('posts:index')),
+            'create_post': ('get', reverse('posts:create_post')),
+            'group_list': ('get', reverse(
+                'posts:group_list', kwargs={'slug': 'budget'})),
+            'profile': ('get', reverse(
+                'posts:profile', kwargs={'username': 'budget_author'})),
+            'post_detail': ('get', reverse(
+                'posts:post_detail', kwargs=post_id)),
+            'post_edit': ('get', reverse('posts:post_edit', kwargs=post_id)),
+            'add_comment': ('post', reverse(
+                'posts:add_comment', kwargs=post_id)),
+            'follow_index': ('get', reverse('posts:follow_index')),
+            'profile_follow': ('get', reverse(
+                'posts:profile_follow', kwargs={'username': 'budget_reader'})),
+            'profile_unfollow': ('get', reverse(
+                'posts:profile_unfollow',
+                kwargs={'username': 'budget_reader'})),
+        }
+        method, url = requests[name]
+        if method == 'post':
+            return self.client.post(url, {'text': 'Ещё комментарий'})
+        return self.client.get(url)
+
+    def test_every_url_has_budget(self):
+        names = {pattern.name for pattern in urls.urlpatterns}
+        self.assertEqual(names, set(QUERY_BUDGETS))
+
+    def test_pages_fit_query_budget(self):
+        # Фильтры Блума строятся один раз на процесс, а не на запрос
+        for kind in lookups.BLOOM_KINDS:
+            lookups.bloom_filter(kind)
+        for name, budget in QUERY_BUDGETS.items():
+            with self.subTest(name=name):
+                with CaptureQueriesContext(connection) as captured:
+                    self.request(name)
+                self.assertLessEqual(
+                    len(captured), budget,
+                    '\n'.join(query['sql'] for query in captured)
+                )
+
+    @override_settings(QUERY_INSPECTOR=True, QUERY_INSPECTOR_THRESHOLD=0)
+    def test_inspector_reports_repeated_queries(self):
+        """Инспектор считает запросы и пишет в лог повторы"""
+        client = Client()
+        with self.assertLogs('core.middleware.queries', 'WARNING') as logs:
+            response = client.get(reverse('posts:index'))
+        self.assertEqual(response['X-Query-Count'], '1')
+        self.assertIn('posts/paginators.py', logs.output[0])
+
+
+@without_page_cache
+class SessionUserCacheTests(TestCase):
+    """Сессия и пользователь сессии не стоят запросов к базе"""
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='session_user', password='old_password')
+
+    def setUp(self):
+        cache.clear()
+
+    def queries_per_view(self):
+        client = Client()
+        client.force_login(self.user)
+        client.get(reverse('posts:index'))
+        with CaptureQueriesContext(connection) as captured:
+            client.get(reverse('posts:index'))
+        return len(captured)
+
+    def test_cache_saves_session_and_user_queries(self):
+        cached = self.queries_per_view()
+        with override_settings(
+            SESSION_ENGINE='django.contrib.sessions.backends.db',
+            AUTHENTICATION_BACKENDS=[
+                'django.contrib.auth.backends.ModelBackend'
+            ],
+        ):
+            uncached = self.queries_per_view()
+        self.assertEqual(uncached - cached, 2)
+
+    def test_password_change_ends_old_sessions(self):
+        self.client.force_login(self.user)
+        url = reverse('posts:follow_index')
+        self.assertEqual(self.client.get(url).status_code, 200)
+        user = User.objects.get(pk=self.user.pk)
+        user.set_password('new_password')
+        user.save()
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+    def test_user_cached_before_commit_forgotten_after(self):
+        user = User.objects.get(pk=self.user.pk)
+        user.is_active = False
+        user.save()
+        # До коммита другой запрос закешировал старую строку
+        cache.set(user_key(self.user.pk), self.user)
+        run_commit_callbacks()
+        self.assertIsNone(cache.get(user_key(self.user.pk)))
+
+    def test_sessions_of_model_backend_survive(self):
+        """Сессии, открытые до кеша пользователей, не разлогиниваются"""
+        self.client.force_login(
+            self.user, 'django.contrib.auth.backends.ModelBackend')
+        response = self.client.get(reverse('posts:follow_index'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_logout_forgets_user(self):
+        self.client.force_login(self.user)
+        self.client.get(reverse('posts:follow_index'))
+        self.assertIsNotNone(cache.get(user_key(self.user.pk)))
+        self.client.logout()
+        self.assertIsNone(cache.get(user_key(self.user.pk)))
+
+
+class IdentityMapTests(TestCase):
+    """Внешние ключи в запросе берут уже загруженные экземпляры"""
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='identity_author')
+        cls.post = Post.objects.create(author=cls.author, text='Пост')
+
+    def test_related_lookup_served_from_map(self):
+        with identity_map() as identity:
+            author = User.objects.get(pk=self.author.pk)
+            with self.assertNumQueries(1):
+                post = Post.objects.get(pk=self.post.pk)
+                self.assertIs(post.author, author)
+        self.assertEqual(identity.hits, {'auth.User': 1})
+
+    def test_full_instance_replaces_deferred(self):
+        with identity_map():
+            User.objects.only('id').get(pk=self.author.pk)
+            author = User.objects.get(pk=self.author.pk)
+            post = Post.objects.get(pk=self.post.pk)
+            self.assertIs(post.author, author)
+
+    def test_no_map_outside_request(self):
+        User.objects.get(pk=self.author.pk)
+        with self.assertNumQueries(2):
+            Post.objects.get(pk=self.post.pk).author
+
+    @override_settings(QUERY_INSPECTOR=True)
+    def test_middleware_reports_avoided_queries(self):
+        self.client.force_login(self.author)
+        response = self.client.get(
+            reverse('posts:post_edit', kwargs={'post_id': self.post.pk}))
+        self.assertEqual(response['X-Identity-Map-Hits'], '1')
@@ -0,0 +1,103 @@
+import re
+
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.contrib.auth import get_user_model
+
+from posts.models import Comment, Follow, Group, Post
+from posts.tests.utils import without_page_cache
+
+User = get_user_model()
+
+# Запросы к этим таблицам обязаны идти по индексам
+FEED_TABLES = re.compile(
+    r'FROM "(posts_post|posts_comment|posts_follow|posts_timelineentry)"')
+
+
+def explain(sql):
+    """Строки плана запроса для текущей базы."""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            # На маленькой тестовой таблице планировщику дешевле
+            # читать её целиком; запрещаем это, чтобы увидеть индексы
+            cursor.execute('SET enable_seqscan = off')
+            cursor.execute('EXPLAIN ' + sql)
+            plan = [row[0] for row in cursor.fetchall()]
+            cursor.execute('RESET enable_seqscan')
+            return plan
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def plan_problems(plan):
+    """Полный просмотр таблицы или сортировка в плане запроса."""
+    problems = []
+    for line in plan:
+        if 'Seq Scan on posts_' in line or re.search(r'\bSort\b', line):
+            problems.append(line)
+        elif re.match(r'SCAN (TABLE )?posts_', line) and 'INDEX' not in line:
+            problems.append(line)
+        elif 'TEMP B-TREE' in line:
+            problems.append(line)
+    return problems
+
+
+@without_page_cache
+class QueryPlanTests(TestCase):
+    """Лента и страница поста не читают таблицы целиком и не сортируют"""
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='planned')
+        cls.reader = User.objects.create_user(username='plan_reader')
+        cls.group = Group.objects.create(title='Группа', slug='planned')
+        for i in range(30):
+            post = Post.objects.create(
+                author=cls.author if i % 2 else cls.reader,
+                group=cls.group if i % 3 else None,
+                text=f'Пост {i}',
+            )
+            Comment.objects.create(
+                post=post, author=cls.reader, text='Комментарий')
+        cls.post = post
+        Follow.objects.create(user=cls.reader, author=cls.author)
+
+    def setUp(self):
+        self.client.force_login(self.reader)
+
+    def assert_indexed(self, url, data=None):
+        with CaptureQueriesContext(connection) as captured:
+            self.client.get(url, data)
+        for query in captured:
+            sql = query['sql']
+            if not sql.startswith('SELECT') or not FEED_TABLES.search(sql):
+                continue
+            with self.subTest(url=url, sql=sql):
+                self.assertEqual(plan_problems(explain(sql)), [])
+
+    def test_feeds_use_indexes(self):
+        urls = [
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': 'planned'}),
+            reverse('posts:profile', kwargs={'username': 'planned'}),
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk}),
+        ]
+        for url in urls:
+            self.assert_indexed(url)
+            self.assert_indexed(url, {'page': 2})
+        page_obj = self.client.get(reverse('posts:index')).context['page_obj']
+        self.assert_indexed(
+            reverse('posts:index'), {'cursor': page_obj.next_cursor})
+
+    def test_follow_feed_engines_use_indexes(self):
+        # Движок 'join' сортирует соединение Follow и Post и остаётся
+        # только как точка отсчёта для bench_follow_feed
+        for engine in ('timeline', 'merge'):
+            with override_settings(FOLLOW_FEED_ENGINE=engine):
+                self.assert_indexed(reverse('posts:follow_index'))
+                self.assert_indexed(reverse('posts:follow_index'), {
+                    'cursor': self.client.get(
+                        reverse('posts:follow_index'), {'cursor': ''}
+                    ).context['page_obj'].next_cursor
+                })
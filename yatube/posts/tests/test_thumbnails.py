@@ -0,0 +1,144 @@
+import shutil
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from posts import thumbnails
+from posts.cards import card_key, post_cards
+from posts.models import Post
+from posts.tests.utils import without_page_cache
+
+User = get_user_model()
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp()
+
+SMALL_GIF = (
+    b'\x47\x49\x46\x38\x39\x61\x02\x00'
+    b'\x01\x00\x80\x00\x00\x00\x00\x00'
+    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+    b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+    b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+    b'\x0A\x00\x3B'
+)
+
+
+@without_page_cache
+# Пул миниатюр писал бы в MEDIA_ROOT, пока тест его удаляет
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, THUMBNAIL_WORKERS=0)
+class ThumbnailTests(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='photographer')
+
+    def create_post(self):
+        return Post.objects.create(
+            author=self.author, text='С картинкой',
+            image=SimpleUploadedFile('small.gif', SMALL_GIF, 'image/gif'),
+        )
+
+    def test_placeholder_until_thumbnail_is_ready(self):
+        post = self.create_post()
+        placeholder = post.image_placeholder
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:post_detail', kwargs={'post_id': post.pk}),
+        )
+        for url in urls:
+            self.assertContains(self.client.get(url), placeholder)
+        thumbnails.generate(post.pk)
+        ready = thumbnails.thumbnail(post)
+        self.assertFalse(ready['pending'])
+        self.assertEqual((ready['width'], ready['height']), (960, 339))
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertContains(response, ready['url'])
+                self.assertNotContains(response, placeholder)
+
+    def test_ready_thumbnail_changes_card_key(self):
+        """Карточку с заглушкой из L1 другого воркера не берём"""
+        post = self.create_post()
+        before = card_key(Post.objects.feed().get(pk=post.pk))
+        thumbnails.generate(post.pk)
+        after = card_key(Post.objects.feed().get(pk=post.pk))
+        self.assertNotEqual(before, after)
+
+    def test_job_queued_once_per_image(self):
+        with mock.patch('posts.thumbnails.transaction') as transaction:
+            post = self.create_post()
+            self.client.get(reverse('posts:index'))
+            post.save()
+        self.assertEqual(transaction.on_commit.call_count, 1)
+
+    def test_upload_stores_image_info(self):
+        post = Post.objects.get(pk=self.create_post().pk)
+        self.assertEqual((post.image_width, post.image_height), (2, 1))
+        self.assertEqual(post.image_size, len(SMALL_GIF))
+        self.assertRegex(post.image_color, r'^#[0-9a-f]{6}$')
+        self.assertTrue(
+            post.image_placeholder.startswith('data:image/jpeg;base64,'))
+        post.image = None
+        post.save()
+        self.assertIsNone(Post.objects.get(pk=post.pk).image_width)
+
+    def test_missing_file_keeps_placeholder(self):
+        post = Post.objects.create(
+            author=self.author, text='Без файла', image='posts/lost.jpg')
+        with self.assertLogs('posts.thumbnails', 'WARNING'):
+            thumbnails.generate(post.pk)
+        self.assertTrue(thumbnails.thumbnail(post)['pending'])
+        self.assertEqual(post.image_placeholder, '')
+        response = self.client.get(reverse('posts:index'))
+        self.assertContains(response, thumbnails.placeholder()['url'])
+
+    def test_page_thumbnails_fetched_at_once(self):
+        posts = [self.create_post() for _ in range(3)]
+        for post in posts[:2]:
+            thumbnails.generate(post.pk)
+        shared = mock.Mock(wraps=cache)
+        with mock.patch('posts.thumbnails.cache', shared):
+            cards = post_cards(Post.objects.feed())
+        self.assertEqual(shared.get.call_count, 0)
+        self.assertEqual(shared.get_many.call_count, 1)
+        ready = thumbnails.thumbnail(posts[0])['url']
+        placeholder = posts[2].image_placeholder
+        self.assertEqual(
+            [placeholder in card for card in cards], [True, False, False]
+        )
+        self.assertIn(ready, cards[2])
+
+    def test_srcset_lists_every_variant(self):
+        post = self.create_post()
+        thumbnails.generate(post.pk)
+        ready = thumbnails.thumbnail(post)
+        self.assertRegex(ready['srcset'], r'^\S+ 480w, \S+ 960w$')
+        response = self.client.get(
+            reverse('posts:post_detail', kwargs={'post_id': post.pk}))
+        self.assertContains(response, f'srcset="{ready["srcset"]}"')
+
+    @override_settings(THUMBNAIL_WEBP=True)
+    def test_webp_only_with_pillow_support(self):
+        with mock.patch('posts.thumbnails.features.check', return_value=True):
+            self.assertEqual(thumbnails.formats(), ['JPEG', 'WEBP'])
+        with mock.patch('posts.thumbnails.features.check', return_value=False):
+            self.assertEqual(thumbnails.formats(), ['JPEG'])
+
+    def test_command_backfills_missing_thumbnails(self):
+        posts = [self.create_post() for _ in range(2)]
+        thumbnails.generate(posts[0].pk)
+        out = StringIO()
+        call_command('build_thumbnails', stdout=out)
+        self.assertIn('Построено: 1, уже были: 1', out.getvalue())
+        self.assertFalse(thumbnails.thumbnail(posts[1])['pending'])
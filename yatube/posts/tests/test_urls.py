@@ -6,10 +6,12 @@ from django.urls import reverse
 from django.contrib.auth import get_user_model
 
 from posts.models import Post, Group
+from posts.tests.utils import without_page_cache
 
 User = get_user_model()
 
 
+@without_page_cache
 class TaskURLTests(TestCase):
     @classmethod
     def setUpClass(cls):
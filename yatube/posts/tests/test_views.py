@@ -1,11 +1,19 @@
+import base64
+import json
+
 from django import forms
-from django.test import Client, TestCase
+from django.test import Client, TestCase, override_settings
 from django.urls import reverse
 from django.contrib.auth import get_user_model
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.core.cache import cache
+from django.utils import timezone
 
 from posts.models import Post, Group, Follow, Comment
+from posts import lookups
+from posts.cards import post_cards
+from posts.paginators import ELLIPSIS, NEXT, elided_page_range
+from posts.tests.utils import run_commit_callbacks, without_page_cache
 
 User = get_user_model()
 
@@ -24,6 +32,7 @@ class Container(object):
         return "'" + self.name + "'"
 
 
+@without_page_cache
 class PostPagesTests(TestCase):
     @classmethod
     def setUpClass(cls):
@@ -155,17 +164,40 @@ class PostPagesTests(TestCase):
         """Проверяем работу кеша на главной странице"""
         response = self.authorized_client.get(reverse('posts:index'))
         before_clearing_the_cache = response.content
+        # Правка в обход сигналов не сдвигает поколение кеша
+        Post.objects.filter(pk=self.post.pk).update(excerpt='Мимо кэша')
+        response = self.authorized_client.get(reverse('posts:index'))
+        self.assertEqual(before_clearing_the_cache, response.content)
         Post.objects.create(
             group=PostPagesTests.group,
             text='Новый текст, после кэша',
             author=User.objects.get(username='Igor'))
         response = self.authorized_client.get(reverse('posts:index'))
         after_add_post_in_cache = response.content
-        self.assertEqual(before_clearing_the_cache, after_add_post_in_cache)
+        self.assertNotEqual(before_clearing_the_cache, after_add_post_in_cache)
+        self.assertIn('Новый текст, после кэша', response.content.decode())
         cache.clear()
         response = self.authorized_client.get(reverse('posts:index'))
-        after_clearing_the_cache = response.content
-        self.assertNotEqual(after_add_post_in_cache, after_clearing_the_cache)
+        self.assertIn('Мимо кэша', response.content.decode())
+
+    def test_feed_cache_follows_pages_and_comments(self):
+        """Кеш лент различает страницы и сбрасывается комментариями"""
+        Post.objects.bulk_create(
+            Post(author=self.user, text=f'Пост {i}') for i in range(12)
+        )
+        url = reverse('posts:profile', kwargs={'username': 'Igor'})
+        first = self.authorized_client.get(url, {'page': 1}).content
+        second = self.authorized_client.get(url, {'page': 2}).content
+        self.assertNotEqual(first, second)
+        post = Post.objects.filter(author=self.user).first()
+        Post.objects.filter(pk=post.pk).update(excerpt='После комментария')
+        self.assertEqual(
+            self.authorized_client.get(url, {'page': 1}).content, first)
+        Comment.objects.create(post=post, author=self.user, text='Ответ')
+        self.assertIn(
+            'После комментария',
+            self.authorized_client.get(url, {'page': 1}).content.decode()
+        )
 
     def test_create_comment_by_authorized_client(self):
         cache.clear()
@@ -187,6 +219,302 @@ class PostPagesTests(TestCase):
         self.assertEqual(Comment.objects.count(), comment_count + 1)
 
 
+class PostCardsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='card')
+        cls.group = Group.objects.create(title='Карточки', slug='cards')
+        for i in range(3):
+            Post.objects.create(
+                author=cls.author, group=cls.group, text=f'Карточка {i}')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_cards_rendered_once_for_all_feeds(self):
+        """Карточка рисуется один раз и берётся из кеша в других лентах"""
+        with self.assertTemplateUsed('includes/post_card.html'):
+            self.client.get(reverse('posts:index'))
+        for url in (
+            reverse('posts:group_list', kwargs={'slug': 'cards'}),
+            reverse('posts:profile', kwargs={'username': 'card'}),
+        ):
+            with self.subTest(url=url):
+                with self.assertTemplateNotUsed('includes/post_card.html'):
+                    response = self.client.get(url)
+                self.assertContains(response, 'Карточка 2')
+
+    def test_changed_post_gets_new_card(self):
+        post = Post.objects.feed().first()
+        html, = post_cards([post])
+        self.assertIn('Карточка 2', html)
+        post.text = 'Новая карточка'
+        post.save()
+        html, = post_cards(Post.objects.feed().filter(pk=post.pk))
+        self.assertIn('Новая карточка', html)
+
+
+class ConditionalGetTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='etag')
+        cls.group = Group.objects.create(title='ETag', slug='etag')
+        cls.post = Post.objects.create(
+            author=cls.author, group=cls.group, text='Пост с ETag')
+
+    def setUp(self):
+        self.urls = [
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': 'etag'}),
+            reverse('posts:profile', kwargs={'username': 'etag'}),
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk}),
+        ]
+
+    def etags(self):
+        return [self.client.get(url)['ETag'] for url in self.urls]
+
+    def test_unchanged_pages_answer_304(self):
+        for url, etag in zip(self.urls, self.etags()):
+            with self.subTest(url=url):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
+
+    def test_comment_and_post_change_etags(self):
+        before = self.etags()
+        Comment.objects.create(
+            post=self.post, author=self.author, text='Новый')
+        after = self.etags()
+        for url, old, new in zip(self.urls, before, after):
+            with self.subTest(url=url):
+                self.assertNotEqual(old, new)
+
+    def test_group_and_author_edits_change_etags(self):
+        """Правка группы и имени автора меняет ETag страниц с ними"""
+        before = self.etags()
+        self.group.title = 'Новое название'
+        self.group.save()
+        after = self.etags()
+        for url, old, new in zip(self.urls[:3], before, after):
+            with self.subTest(url=url):
+                self.assertNotEqual(old, new)
+        author = User.objects.get(pk=self.author.pk)
+        author.first_name = 'Новое имя'
+        author.save()
+        for url, old, new in zip(self.urls, after, self.etags()):
+            with self.subTest(url=url):
+                self.assertNotEqual(old, new)
+
+    def test_etag_depends_on_user(self):
+        anonymous = self.etags()
+        self.client.force_login(self.author)
+        self.assertNotEqual(anonymous, self.etags())
+
+    def test_missing_objects_still_404(self):
+        response = self.client.get(
+            reverse('posts:group_list', kwargs={'slug': 'missing'}),
+            HTTP_IF_NONE_MATCH='*'
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+class AnonymousPageCacheTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='anon_cache')
+        cls.post = Post.objects.create(author=cls.author, text='Первый')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_anonymous_pages_cached_until_write(self):
+        url = reverse('posts:index')
+        self.assertEqual(self.client.get(url)['X-Page-Cache'], 'miss')
+        response = self.client.get(url)
+        self.assertEqual(response['X-Page-Cache'], 'hit')
+        self.assertContains(response, 'Первый')
+        Post.objects.create(author=self.author, text='Второй')
+        response = self.client.get(url)
+        self.assertEqual(response['X-Page-Cache'], 'miss')
+        self.assertContains(response, 'Второй')
+
+    def test_query_string_is_part_of_key(self):
+        url = reverse('posts:index')
+        self.client.get(url)
+        self.assertEqual(
+            self.client.get(url, {'page': 2})['X-Page-Cache'], 'miss')
+
+    def test_follow_changes_profile_counters(self):
+        url = reverse('posts:profile', kwargs={'username': 'anon_cache'})
+        self.client.get(url)
+        Follow.objects.create(
+            user=User.objects.create_user(username='fan'), author=self.author)
+        self.assertEqual(self.client.get(url)['X-Page-Cache'], 'miss')
+
+    def test_unlisted_pages_skip_cache(self):
+        self.assertFalse(
+            self.client.get('/about/author/').has_header('X-Page-Cache'))
+
+
+class SkeletonPageCacheTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='skeleton')
+        cls.reader = User.objects.create_user(username='bones')
+        cls.post = Post.objects.create(author=cls.author, text='Скелет')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_skeleton_shared_holes_per_user(self):
+        """Скелет общий, а шапка и кнопка подписки у каждого свои"""
+        url = reverse('posts:profile', kwargs={'username': 'skeleton'})
+        self.client.force_login(self.author)
+        response = self.client.get(url)
+        self.assertEqual(response['X-Page-Cache'], 'miss')
+        self.assertContains(response, 'Пользователь: skeleton')
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.client.get(url)
+        self.client.force_login(self.reader)
+        response = self.client.get(url)
+        self.assertEqual(response['X-Page-Cache'], 'hit')
+        self.assertContains(response, 'Пользователь: bones')
+        self.assertContains(response, 'Отписаться')
+        self.assertNotContains(response, '<!--hole:')
+
+    def test_comment_form_filled_with_csrf_token(self):
+        url = reverse('posts:post_detail', kwargs={'post_id': self.post.pk})
+        self.client.force_login(self.reader)
+        self.client.get(url)
+        response = self.client.get(url)
+        self.assertEqual(response['X-Page-Cache'], 'hit')
+        self.assertContains(response, 'csrfmiddlewaretoken" value="')
+        self.assertEqual(
+            self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+            .status_code,
+            304
+        )
+
+    def test_anonymous_pages_render_holes_in_place(self):
+        response = self.client.get(reverse('posts:index'))
+        self.assertContains(response, 'Войти')
+        self.assertNotContains(response, '<!--hole:')
+
+
+class MissingLookupTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='prober')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+        self.missing = [
+            reverse('posts:profile', kwargs={'username': 'ghost'}),
+            reverse('posts:group_list', kwargs={'slug': 'ghost'}),
+            reverse('posts:post_detail', kwargs={'post_id': 404}),
+            reverse('posts:profile_follow', kwargs={'username': 'ghost'}),
+        ]
+
+    def test_repeated_misses_skip_database(self):
+        for url in self.missing:
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, 404)
+                with self.assertNumQueries(0):
+                    self.assertEqual(self.client.get(url).status_code, 404)
+
+    @override_settings(LOOKUP_BLOOM_FILTER=False)
+    def test_created_objects_found_after_miss(self):
+        for url in self.missing[:3]:
+            self.client.get(url)
+        Group.objects.create(title='Призрак', slug='ghost')
+        author = User.objects.create_user(username='ghost')
+        Post.objects.create(pk=404, author=author, text='Нашёлся')
+        for url in self.missing[:3]:
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_miss_cached_before_commit_dropped_after(self):
+        Group.objects.create(title='Призрак', slug='ghost')
+        # Другой воркер не видит группу, пока транзакция не закоммичена
+        lookups.remember_missing('group', 'ghost')
+        run_commit_callbacks()
+        self.assertFalse(lookups.known_missing('group', 'ghost'))
+
+    def test_bloom_filter_rejects_without_database(self):
+        url = reverse('posts:group_list', kwargs={'slug': 'never'})
+        self.client.get(reverse('posts:group_list', kwargs={'slug': 'x'}))
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url).status_code, 404)
+        Group.objects.create(title='Новая', slug='never')
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_new_names_join_filter_without_rebuild(self):
+        """Новый пользователь не перестраивает фильтр из всей таблицы"""
+        lookups.bloom_filter('user')
+        User.objects.create_user(username='newcomer')
+        run_commit_callbacks()
+        with self.assertNumQueries(0):
+            self.assertFalse(lookups.known_missing('user', 'newcomer'))
+
+
+@without_page_cache
+class CachedLookupTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='cached')
+        cls.group = Group.objects.create(title='Кеш', slug='cached')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_second_lookup_skips_database(self):
+        before = lookups.lookup_stats()['group']
+        lookups.find('group', 'cached')
+        with self.assertNumQueries(0):
+            group = lookups.find('group', 'cached')
+        self.assertEqual(group, self.group)
+        after = lookups.lookup_stats()['group']
+        self.assertEqual(after['hits'] - before['hits'], 1)
+        self.assertEqual(after['misses'] - before['misses'], 1)
+
+    def test_cached_user_has_no_counters(self):
+        lookups.find('user', 'cached')
+        author = lookups.find('user', 'cached')
+        self.assertEqual(author.get_deferred_fields(), {
+            field.attname for field in User._meta.concrete_fields
+        } - set(lookups.CACHED_FIELDS['user']))
+        self.assertNotIn('counters', author._state.fields_cache)
+
+    def test_rename_forgets_old_value(self):
+        lookups.find('user', 'cached')
+        user = User.objects.get(pk=self.user.pk)
+        user.username = 'renamed'
+        user.save()
+        self.assertIsNone(lookups.find('user', 'cached'))
+        self.assertEqual(lookups.find('user', 'renamed'), self.user)
+
+    @override_settings(LOOKUP_BLOOM_FILTER=False)
+    def test_cached_before_commit_dropped_after(self):
+        user = User.objects.get(pk=self.user.pk)
+        user.username = 'renamed'
+        user.save()
+        # До коммита другой воркер закешировал пользователя под старым
+        # именем
+        cache.set(lookups.lookup_key('user', 'cached'), self.user)
+        run_commit_callbacks()
+        self.assertIsNone(lookups.find('user', 'cached'))
+
+    def test_edit_and_delete_refresh_group_page(self):
+        url = reverse('posts:group_list', kwargs={'slug': 'cached'})
+        self.client.get(url)
+        group = Group.objects.get(pk=self.group.pk)
+        group.description = 'Новое описание'
+        group.save()
+        self.assertContains(self.client.get(url), 'Новое описание')
+        group.delete()
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
 class PaginatorViewsTest(TestCase):
     """Проверим заполняемость страниц постами"""
     @classmethod
@@ -247,6 +575,146 @@ class PaginatorViewsTest(TestCase):
                 len(response.context.get('page_obj').object_list), 3)
 
 
+class CursorPaginatorViewsTest(TestCase):
+    """Проверим курсорную пагинацию лент"""
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='cursor_author')
+        cls.group = Group.objects.create(
+            title='Группа для курсоров',
+            slug='cursor_slug',
+            description='Тестовое описание')
+        Post.objects.bulk_create(
+            Post(text=f'Пост {i}', author=cls.author, group=cls.group)
+            for i in range(13)
+        )
+
+    def test_cursor_walks_feeds_forward_and_back(self):
+        """По next_cursor и previous_cursor обходим все посты ленты"""
+        list_urls = [
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': 'cursor_slug'}),
+            reverse('posts:profile', kwargs={'username': 'cursor_author'}),
+        ]
+        expected = list(Post.objects.order_by('-pub_date', '-id'))
+        for url in list_urls:
+            with self.subTest(url=url):
+                first_page = self.client.get(url).context['page_obj']
+                self.assertTrue(first_page.is_cursor)
+                self.assertFalse(first_page.has_previous())
+                self.assertEqual(list(first_page), expected[:10])
+                second_page = self.client.get(
+                    url, {'cursor': first_page.next_cursor}
+                ).context['page_obj']
+                self.assertEqual(list(second_page), expected[10:])
+                self.assertFalse(second_page.has_next())
+                back_page = self.client.get(
+                    url, {'cursor': second_page.previous_cursor}
+                ).context['page_obj']
+                self.assertEqual(list(back_page), expected[:10])
+                self.assertFalse(back_page.has_previous())
+
+    def test_broken_cursor_opens_first_page(self):
+        """Битый токен курсора открывает первую страницу"""
+        response = self.client.get(
+            reverse('posts:index'), {'cursor': 'не-курсор'}
+        )
+        self.assertEqual(len(response.context['page_obj']), 10)
+        self.assertFalse(response.context['page_obj'].has_previous())
+
+    def test_invalid_cursor_values_open_first_page(self):
+        """Наивное время и id вне диапазона базы - тоже битый токен"""
+        now = timezone.now().isoformat()
+        positions = [
+            ['2021-01-01T00:00:00', 1],
+            [now, 10 ** 30],
+            [now, 0],
+            [now, True],
+        ]
+        urls = [
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': 'cursor_slug'}),
+            reverse('posts:profile', kwargs={'username': 'cursor_author'}),
+        ]
+        for pub_date, pk in positions:
+            token = base64.urlsafe_b64encode(
+                json.dumps([NEXT, pub_date, pk]).encode()
+            ).decode()
+            for url in urls:
+                with self.subTest(url=url, pk=pk):
+                    page_obj = self.client.get(
+                        url, {'cursor': token}).context['page_obj']
+                    self.assertEqual(len(page_obj), 10)
+                    self.assertFalse(page_obj.has_previous())
+
+
+class PaginationModesViewsTest(TestCase):
+    """Проверим нумерованные страницы с оценкой и без подсчёта"""
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='modes_author')
+        cls.group = Group.objects.create(
+            title='Группа для режимов',
+            slug='modes_slug',
+            description='Тестовое описание')
+        Post.objects.bulk_create(
+            Post(text=f'Пост {i}', author=cls.author, group=cls.group)
+            for i in range(25)
+        )
+
+    def test_numbered_modes_split_posts_by_pages(self):
+        """Режимы estimate и countless листают те же страницы"""
+        url = reverse('posts:group_list', kwargs={'slug': 'modes_slug'})
+        for mode in ('page', 'estimate', 'countless'):
+            with self.subTest(mode=mode), override_settings(
+                POSTS_PAGINATION={'group_list': mode}
+            ):
+                # Страницы анонимов кешируются целиком, а режим
+                # пагинации меняется без записи в базу
+                cache.clear()
+                sizes = [
+                    len(self.client.get(
+                        url, {'page': number}
+                    ).context['page_obj'])
+                    for number in (1, 2, 3)
+                ]
+                self.assertEqual(sizes, [10, 10, 5])
+
+    def test_countless_mode_knows_only_next_page(self):
+        """Без подсчёта паджинатор знает только следующую страницу"""
+        url = reverse('posts:group_list', kwargs={'slug': 'modes_slug'})
+        with override_settings(POSTS_PAGINATION={'group_list': 'countless'}):
+            page_obj = self.client.get(url).context['page_obj']
+            self.assertTrue(page_obj.has_next())
+            self.assertEqual(page_obj.paginator.num_pages, 2)
+            last_page = self.client.get(url, {'page': 3}).context['page_obj']
+            self.assertFalse(last_page.has_next())
+            missing = self.client.get(url, {'page': 50}).context['page_obj']
+            self.assertEqual(missing.number, 1)
+
+    def test_huge_page_number_opens_first_page(self):
+        """Номер страницы с OFFSET больше bigint не доходит до базы"""
+        url = reverse('posts:group_list', kwargs={'slug': 'modes_slug'})
+        for mode in ('estimate', 'countless'):
+            with self.subTest(mode=mode), override_settings(
+                POSTS_PAGINATION={'group_list': mode}
+            ):
+                cache.clear()
+                page_obj = self.client.get(
+                    url, {'page': 10 ** 30}).context['page_obj']
+                self.assertEqual(page_obj.number, 1)
+
+    def test_elided_page_range(self):
+        """Длинный список страниц сворачивается вокруг текущей"""
+        self.assertEqual(elided_page_range(2, 5), [1, 2, 3, 4, 5])
+        self.assertEqual(
+            elided_page_range(50, 100),
+            [1, ELLIPSIS, 48, 49, 50, 51, 52, ELLIPSIS, 100]
+        )
+
+
 class FollowTests(TestCase):
     def setUp(self):
         self.client_auth_follower = Client()
@@ -295,3 +763,69 @@ class FollowTests(TestCase):
             reverse('posts:follow_index'))
 
         self.assertIn(post, response.context['page_obj'].object_list)
+
+    def test_unfollow_removes_posts_from_feed(self):
+        """после отписки посты автора пропадают из ленты"""
+        Follow.objects.create(
+            user=self.user_following,
+            author=self.user_follower)
+        Follow.objects.filter(
+            user=self.user_following,
+            author=self.user_follower).delete()
+        response = self.client_auth_following.get(
+            reverse('posts:follow_index'))
+        self.assertNotIn(self.post, response.context['page_obj'].object_list)
+
+    def test_feed_engines_agree(self):
+        """все движки ленты подписок отдают одни и те же посты"""
+        Follow.objects.create(
+            user=self.user_following,
+            author=self.user_follower)
+        post = Post.objects.create(
+            author=self.user_follower,
+            text='Пост после подписки')
+        expected = [post, self.post]
+        # Нулевой лимит заставляет ленту читать посты автора напрямую
+        for engine, limit in (
+            ('join', 1000), ('timeline', 1000), ('timeline', 0),
+            ('merge', 1000),
+        ):
+            with self.subTest(engine=engine, limit=limit), override_settings(
+                FOLLOW_FEED_ENGINE=engine, TIMELINE_FANOUT_LIMIT=limit
+            ):
+                response = self.client_auth_following.get(
+                    reverse('posts:follow_index'))
+                self.assertEqual(
+                    list(response.context['page_obj']), expected)
+
+    @override_settings(FOLLOW_FEED_ENGINE='timeline', TIMELINE_FANOUT_LIMIT=1)
+    def test_timeline_refilled_when_author_drops_under_limit(self):
+        """посты, опубликованные сверх лимита, остаются в ленте"""
+        other = User.objects.create_user(username='other_follower')
+        Follow.objects.create(
+            user=self.user_following, author=self.user_follower)
+        Follow.objects.create(user=other, author=self.user_follower)
+        post = Post.objects.create(
+            author=self.user_follower, text='Пост сверх лимита')
+        Follow.objects.filter(user=other).delete()
+        response = self.client_auth_following.get(
+            reverse('posts:follow_index'))
+        self.assertEqual(list(response.context['page_obj']), [post, self.post])
+
+    @override_settings(FOLLOW_FEED_ENGINE='merge')
+    def test_merge_feed_sees_new_posts(self):
+        """новый пост сбрасывает кеш свежих постов автора"""
+        Follow.objects.create(
+            user=self.user_following,
+            author=self.user_follower)
+        self.client_auth_following.get(reverse('posts:follow_index'))
+        post = Post.objects.create(
+            author=self.user_follower,
+            text='Пост после первого чтения ленты')
+        response = self.client_auth_following.get(
+            reverse('posts:follow_index'))
+        self.assertEqual(response.context['page_obj'][0], post)
+        # Курсорная страница ищет по тому же слитому списку
+        response = self.client_auth_following.get(
+            reverse('posts:follow_index'), {'cursor': ''})
+        self.assertEqual(list(response.context['page_obj']), [post, self.post])
@@ -0,0 +1,16 @@
+from django.db import connection
+from django.test import override_settings
+
+# Страница из кеша целиком (core.middleware.pages) не рисует шаблоны
+# и не ходит в базу, поэтому тесты контекста, шаблонов и запросов
+# страниц этот кеш выключают
+without_page_cache = override_settings(
+    PAGE_CACHE_TTLS={}, SKELETON_CACHE_TTLS={}
+)
+
+
+def run_commit_callbacks():
+    """Выполняет колбэки on_commit: TestCase транзакцию не коммитит."""
+    callbacks, connection.run_on_commit = connection.run_on_commit, []
+    for _, callback in callbacks:
+        callback()
@@ -0,0 +1,212 @@
+"""Миниатюры картинок постов, готовые заранее.
+
+Миниатюру строит sorl.thumbnail в фоновом пуле потоков: сохранение
+поста с картинкой ставит задачу после коммита транзакции. Шаблоны
+только смотрят в кеш готовых миниатюр (thumbnail) и, пока задача не
+выполнена, показывают заглушку THUMBNAIL_PLACEHOLDER. Промах кеша у
+старой картинки сам ставит задачу.
+
+Адрес готовой миниатюры входит в версию карточки поста (ready), а
+сама миниатюра сдвигает поколения его лент, чтобы заглушка не
+осталась в кеше карточек и страниц ни в одном воркере.
+THUMBNAIL_WORKERS = 0 строит миниатюры прямо в вызывающем потоке.
+
+Лента берёт миниатюры всей страницы одним get_many (prefetch), а
+не по запросу к кешу на каждую карточку.
+
+Миниатюра - набор вариантов разной ширины из THUMBNAIL_VARIANTS для
+srcset; с THUMBNAIL_WEBP каждый вариант есть ещё и в WebP, если его
+умеет Pillow. Смена вариантов уводит кеш на новые ключи, старые
+картинки достраивает команда build_thumbnails.
+"""
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.templatetags.static import static
+from PIL import features
+from sorl.thumbnail import get_thumbnail
+
+from .cache import bump, post_scopes
+from .models import Post
+
+logger = logging.getLogger(__name__)
+
+# Варианты по возрастанию ширины; самый широкий идёт в src
+VARIANTS = [
+    {'geometry': '480x170'},
+    {'geometry': '960x339'},
+]
+OPTIONS = {'crop': 'center', 'upscale': True}
+SIZES = '(max-width: 960px) 100vw, 960px'
+WORKERS = 2
+PLACEHOLDER = 'img/thumbnail-placeholder.svg'
+# Через сколько секунд упавшую или потерянную задачу можно повторить
+RETRY_AFTER = 10 * 60
+
+_missing = object()
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def variants():
+    """Варианты миниатюры: пары (geometry, опции sorl)."""
+    found = []
+    for spec in getattr(settings, 'THUMBNAIL_VARIANTS', VARIANTS):
+        options = dict(OPTIONS, **spec)
+        found.append((options.pop('geometry'), options))
+    return found
+
+
+def formats():
+    webp = getattr(settings, 'THUMBNAIL_WEBP', False)
+    return ['JPEG', 'WEBP'] if webp and features.check('webp') else ['JPEG']
+
+
+def thumbnail_key(name):
+    spec = f'{name}:{variants()}:{formats()}'
+    return f'posts:thumb:{hashlib.md5(spec.encode()).hexdigest()}'
+
+
+def pending_key(name):
+    return thumbnail_key(name) + ':pending'
+
+
+def sizes():
+    return getattr(settings, 'THUMBNAIL_SIZES', SIZES)
+
+
+def placeholder():
+    width, height = map(int, variants()[-1][0].split('x'))
+    return {
+        'url': static(getattr(
+            settings, 'THUMBNAIL_PLACEHOLDER', PLACEHOLDER
+        )),
+        'width': width,
+        'height': height,
+        'srcset': '',
+        'webp_srcset': '',
+        'sizes': sizes(),
+        'pending': True,
+    }
+
+
+def srcset(images):
+    return ', '.join(f'{image.url} {image.width}w' for image in images)
+
+
+def generate(post_id):
+    """Строит варианты миниатюры картинки поста и кладёт их в кеш.
+
+    Возвращает False, если у поста нет картинки или её файла.
+    """
+    post = Post.objects.feed().filter(pk=post_id).first()
+    if post is None or not post.image:
+        return False
+    name = post.image.name
+    if not post.image.storage.exists(name):
+        logger.warning('Нет файла картинки поста %s: %s', post_id, name)
+        return False
+    built = {
+        image_format: [
+            get_thumbnail(
+                post.image, geometry, format=image_format, **options
+            )
+            for geometry, options in variants()
+        ]
+        for image_format in formats()
+    }
+    widest = built['JPEG'][-1]
+    cache.set(thumbnail_key(name), {
+        'url': widest.url,
+        'width': widest.width,
+        'height': widest.height,
+        'srcset': srcset(built['JPEG']),
+        'webp_srcset': srcset(built.get('WEBP', [])),
+        'sizes': sizes(),
+        'pending': False,
+    }, None)
+    cache.delete(pending_key(name))
+    bump(*post_scopes(post))
+    return True
+
+
+def _build(post_id):
+    try:
+        generate(post_id)
+    except Exception:
+        logger.exception('Не удалось построить миниатюру поста %s', post_id)
+
+
+def _run(post_id):
+    try:
+        _build(post_id)
+    finally:
+        # У потока пула своё соединение с базой
+        connections.close_all()
+
+
+def executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'THUMBNAIL_WORKERS', WORKERS),
+                thread_name_prefix='thumbnails',
+            )
+        return _executor
+
+
+def schedule(post_id, name):
+    """Ставит построение миниатюры после коммита, без повторов."""
+    if not cache.add(pending_key(name), True, RETRY_AFTER):
+        return
+    if getattr(settings, 'THUMBNAIL_WORKERS', WORKERS):
+        transaction.on_commit(lambda: executor().submit(_run, post_id))
+    else:
+        transaction.on_commit(lambda: _build(post_id))
+
+
+def prepare(post):
+    """Ставит задачу, если миниатюры картинки поста ещё нет."""
+    if post.image and cache.get(thumbnail_key(post.image.name)) is None:
+        schedule(post.pk, post.image.name)
+
+
+def prefetch(posts):
+    """Достаёт миниатюры картинок постов одним get_many.
+
+    Результат запоминается на посте, и thumbnail берёт его оттуда.
+    """
+    posts = [post for post in posts if post.image]
+    keys = {post: thumbnail_key(post.image.name) for post in posts}
+    found = cache.get_many(set(keys.values())) if keys else {}
+    for post, key in keys.items():
+        post._thumbnail = found.get(key)
+
+
+def ready(post):
+    """Адрес готовой миниатюры поста или None, без постановки задачи."""
+    if not post.image:
+        return None
+    found = getattr(post, '_thumbnail', _missing)
+    if found is _missing:
+        found = post._thumbnail = cache.get(thumbnail_key(post.image.name))
+    return found and found['url']
+
+
+def thumbnail(post):
+    """Готовая миниатюра поста, заглушка или None без картинки."""
+    if not post.image:
+        return None
+    found = getattr(post, '_thumbnail', _missing)
+    if found is _missing:
+        found = cache.get(thumbnail_key(post.image.name))
+    if found is None:
+        schedule(post.pk, post.image.name)
+        return placeholder()
+    return found
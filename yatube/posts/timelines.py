@@ -0,0 +1,115 @@
+"""Материализованные ленты подписок (fan-out on write).
+
+При публикации поста он раскладывается по лентам подписчиков автора,
+при подписке в ленту подтягиваются свежие посты автора, при отписке
+они из ленты удаляются. Авторов с очень большим числом подписчиков
+не раскладываем: их посты лента подмешивает при чтении. Когда
+такой автор снова опускается до лимита, свежие посты раскладываются
+по лентам всех его подписчиков заново (refill).
+"""
+from django.conf import settings
+
+from .models import Follow, Post, TimelineEntry, UserCounters
+
+# Сколько подписчиков может быть у автора, чтобы его посты ещё
+# раскладывались по лентам при публикации
+FANOUT_LIMIT = 1000
+# Сколько последних постов автора добавить в ленту при подписке
+BACKFILL_SIZE = 200
+BATCH_SIZE = 500
+
+
+def fanout_limit():
+    return getattr(settings, 'TIMELINE_FANOUT_LIMIT', FANOUT_LIMIT)
+
+
+def is_pulled(author_id):
+    """Посты автора читаются из Post, а не раскладываются по лентам."""
+    return UserCounters.objects.filter(
+        user_id=author_id, followers_count__gt=fanout_limit()
+    ).exists()
+
+
+def fan_out(post):
+    """Добавляет новый пост в ленты подписчиков автора."""
+    if is_pulled(post.author_id):
+        return
+    follower_ids = Follow.objects.filter(
+        author_id=post.author_id
+    ).values_list('user_id', flat=True)
+    TimelineEntry.objects.bulk_create(
+        (
+            TimelineEntry(
+                user_id=user_id,
+                post_id=post.pk,
+                author_id=post.author_id,
+                pub_date=post.pub_date,
+            )
+            for user_id in follower_ids.iterator()
+        ),
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+def fill(user_ids, author_id):
+    """Кладёт свежие посты автора в ленты пользователей user_ids."""
+    size = getattr(settings, 'TIMELINE_BACKFILL_SIZE', BACKFILL_SIZE)
+    posts = list(Post.objects.filter(
+        author_id=author_id
+    ).order_by('-pub_date').values_list('pk', 'pub_date')[:size])
+    TimelineEntry.objects.bulk_create(
+        (
+            TimelineEntry(
+                user_id=user_id,
+                post_id=pk,
+                author_id=author_id,
+                pub_date=pub_date,
+            )
+            for user_id in user_ids
+            for pk, pub_date in posts
+        ),
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+def backfill(follow):
+    """Подтягивает свежие посты автора в ленту нового подписчика."""
+    if is_pulled(follow.author_id):
+        return
+    fill([follow.user_id], follow.author_id)
+
+
+def prune(follow):
+    """Убирает посты автора из ленты отписавшегося пользователя.
+
+    Если автор этой отпиской опустился до лимита, его посты снова
+    раскладываются: ленты подписчиков дополняет refill.
+    """
+    TimelineEntry.objects.filter(
+        user_id=follow.user_id, author_id=follow.author_id
+    ).delete()
+    if UserCounters.objects.filter(
+        user_id=follow.author_id, followers_count=fanout_limit()
+    ).exists():
+        refill(follow.author_id)
+
+
+def refill(author_id):
+    """Раскладывает свежие посты автора по лентам всех подписчиков.
+
+    Пока автор был выше лимита, его посты и новые подписки в ленты
+    не попадали.
+    """
+    follower_ids = Follow.objects.filter(
+        author_id=author_id
+    ).values_list('user_id', flat=True)
+    fill(follower_ids.iterator(), author_id)
+
+
+def pulled_author_ids(user):
+    """Авторы из подписок пользователя, чьи посты читаются при чтении."""
+    return Follow.objects.filter(
+        user=user, author__counters__followers_count__gt=fanout_limit()
+    ).values_list('author_id', flat=True)
@@ -1,74 +1,135 @@
-from django.shortcuts import render, get_object_or_404, redirect
+from django.shortcuts import render, redirect
 from django.urls import reverse
-from django.core.paginator import Paginator
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition
+from django.conf import settings
 
-from .models import Post, Group, User, Follow
+from . import counters
+from .models import Post, Follow
 from .forms import PostForm, CommentForm
+from .paginators import paginate
+from .feeds import follow_feed
+from .cache import feed_fragment, page_etag
+from .lookups import find, get_or_404
+from .images import request_files
 
 SHOW_SOME_POSTS = 10
 
 
-def paginator(request, info):
-    paginator = Paginator(info, SHOW_SOME_POSTS)
-    page_number = request.GET.get('page')
-    return paginator.get_page(page_number)
+def paginator(request, info, feed=None, count=None):
+    # Режим пагинации каждой ленты задаётся в settings.POSTS_PAGINATION,
+    # count - значение счётчика для режима 'estimate'
+    mode = getattr(settings, 'POSTS_PAGINATION', {}).get(feed, 'page')
+    return paginate(request, info, SHOW_SOME_POSTS, mode, count)
 
 
+# ETag страниц считается до запуска view: на If-None-Match
+# с тем же значением Django сразу отвечает 304 без ленты и шаблонов
+
+def index_etag(request):
+    return page_etag(request, 'all')
+
+
+# Без ETag view сам ответит 404, заглянув в кеш промахов. Группу и
+# автора берём из кеша находок (posts.lookups), и view их не ищет
+# в базе повторно
+
+def group_etag(request, slug):
+    group = find('group', slug)
+    if group is None:
+        return None
+    return page_etag(request, f'group:{group.pk}')
+
+
+def profile_etag(request, username):
+    author = find('user', username)
+    if author is None:
+        return None
+    # Счётчики подписок автора и кнопка подписки зрителя
+    return page_etag(
+        request,
+        f'author:{author.pk}', f'follow:{author.pk}',
+        f'followers:{author.pk}',
+    )
+
+
+def post_etag(request, post_id):
+    post = find('post', post_id, Post.objects.only('author_id'))
+    if post is None:
+        return None
+    # Пост с комментариями и счётчик постов автора
+    return page_etag(request, f'post:{post_id}', f'author:{post.author_id}')
+
+
+@condition(etag_func=index_etag)
 def index(request):
     template = 'posts/index.html'
-    post_list = Post.objects.select_related('author').all()
-    page_obj = paginator(request, post_list)
+    post_list = Post.objects.feed()
+    page_obj = paginator(request, post_list, 'index')
     profile = True
     index = False
     context = {
         'page_obj': page_obj,
+        'feed_cache': feed_fragment(request, 'index', 'all'),
         'profile': profile,
         'index': index
     }
     return render(request, template, context)
 
 
+@condition(etag_func=group_etag)
 def group_posts(request, slug):
     template = 'posts/group_list.html'
-    group = get_object_or_404(Group, slug=slug)
-    post_list = group.posts.all()
-    page_obj = paginator(request, post_list)
+    group = get_or_404('group', slug)
+    post_list = group.posts.feed()
+    page_obj = paginator(
+        request, post_list, 'group_list', count=group.posts_count
+    )
     context = {
         'group': group,
         'page_obj': page_obj,
+        'feed_cache': feed_fragment(
+            request, 'group_list', f'group:{group.pk}'
+        ),
     }
     return render(request, template, context)
 
 
+@condition(etag_func=profile_etag)
 def profile(request, username):
     template = 'posts/profile.html'
-    author = get_object_or_404(User, username=username)
-    post_list = author.posts.select_related("group", "author")
-    page_obj = paginator(request, post_list)
-    if request.user.is_authenticated:
-        following = Follow.objects.filter(
-            user=request.user, author=author
-        ).exists()
-    else:
-        following = False
-    profile = author
+    # Счётчики меняются часто и в кеш находок не попадают
+    author = get_or_404('user', username)
+    post_list = author.posts.feed()
+    page_obj = paginator(
+        request, post_list, 'profile',
+        count=counters.user_counters(author).posts_count
+    )
+    # Кнопку подписки рисует дырка follow_button (posts.holes)
+    profile = True
     index = False
     context = {
         'page_obj': page_obj,
+        'feed_cache': feed_fragment(
+            request, 'profile', f'author:{author.pk}'
+        ),
         'author': author,
-        'following': following,
         'profile': profile,
         'index': index
     }
     return render(request, template, context)
 
 
+@condition(etag_func=post_etag)
 def post_detail(request, post_id):
     template = 'posts/post_detail.html'
-    post = get_object_or_404(Post, pk=post_id)
-    comments = post.comments.all()
+    post = get_or_404(
+        'post', post_id,
+        Post.objects.select_related('author__counters', 'group')
+    )
+    counters.user_counters(post.author)
+    comments = post.comments.select_related('author')
     context = {
         'post': post,
         'form': CommentForm(),
@@ -81,7 +142,9 @@ def post_detail(request, post_id):
 def post_create(request):
     is_edit = False
     template = 'posts/create_post.html'
-    form = PostForm(request.POST or None, files=request.FILES or None)
+    form = PostForm(
+        request.POST or None, files=request_files(request) or None
+    )
     if form.is_valid():
         post = form.save(commit=False)
         post.author = request.user
@@ -98,8 +161,10 @@ def post_create(request):
 def post_edit(request, post_id):
     is_edit = True
     template = 'posts/create_post.html'
-    post = get_object_or_404(Post, pk=post_id)
-    form = PostForm(request.POST, files=request.FILES or None, instance=post)
+    post = get_or_404('post', post_id)
+    form = PostForm(
+        request.POST, files=request_files(request) or None, instance=post
+    )
     if request.user == post.author:
         if form.is_valid():
             post = form.save(commit=False)
@@ -117,7 +182,7 @@ def post_edit(request, post_id):
 @login_required
 @csrf_exempt
 def add_comment(request, post_id):
-    post = get_object_or_404(Post, id=post_id)
+    post = get_or_404('post', post_id)
     form = CommentForm(request.POST or None)
     if form.is_valid():
         comment = form.save(commit=False)
@@ -135,12 +200,15 @@ def add_comment(request, post_id):
 @login_required
 def follow_index(request):
     template = 'posts/follow.html'
-    list_of_posts = Post.objects.filter(author__following__user=request.user)
-    page_obj = paginator(request, list_of_posts)
+    list_of_posts = follow_feed(request.user)
+    page_obj = paginator(request, list_of_posts, 'follow_index')
     index = True
     profile = False
     context = {
         'page_obj': page_obj,
+        'feed_cache': feed_fragment(
+            request, 'follow_index', 'all', f'follow:{request.user.pk}'
+        ),
         'index': index,
         'profile': profile
     }
@@ -150,7 +218,7 @@ def follow_index(request):
 @login_required
 def profile_follow(request, username):
     user = request.user
-    author = User.objects.get(username=username)
+    author = get_or_404('user', username)
     if user != author:
         Follow.objects.get_or_create(user=user, author=author)
     return redirect(reverse('posts:profile', args=[username]))
@@ -158,7 +226,7 @@ def profile_follow(request, username):
 
 @login_required
 def profile_unfollow(request, username):
-    author = get_object_or_404(User, username=username)
+    author = get_or_404('user', username)
     is_follower = Follow.objects.filter(user=request.user, author=author)
     is_follower.delete()
     return redirect('posts:profile', username=author)
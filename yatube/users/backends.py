@@ -0,0 +1,40 @@
+"""Загрузка пользователя сессии из кеша.
+
+ModelBackend на каждый запрос с сессией достаёт пользователя из
+базы. CachedModelBackend сначала смотрит в кеш: запись лежит под
+id пользователя, поэтому её делят все его сессии. Запись снимают
+сохранение пользователя (в том числе смена пароля и last_login при
+входе), удаление и выход (users.signals). Хеш пароля в сессии Django
+сверяет с пользователем из кеша, поэтому после смены пароля старые
+сессии не проходят, как и без кеша.
+"""
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+
+from core.identity import remember
+
+AUTH_USER_CACHE_TIMEOUT = 5 * 60
+
+
+def user_key(user_id):
+    return f'auth:user:{user_id}'
+
+
+def forget_user(user_id):
+    cache.delete(user_key(user_id))
+
+
+class CachedModelBackend(ModelBackend):
+    def get_user(self, user_id):
+        key = user_key(user_id)
+        user = cache.get(key)
+        if user is not None:
+            remember(user)
+            return user
+        user = super().get_user(user_id)
+        if user is not None:
+            cache.set(key, user, getattr(
+                settings, 'AUTH_USER_CACHE_TIMEOUT', AUTH_USER_CACHE_TIMEOUT
+            ))
+        return user
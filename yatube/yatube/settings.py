@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/2.2/ref/settings/
 """
 import os
+import sys
 from dotenv import load_dotenv
 import sentry_sdk
 from sentry_sdk.integrations.django import DjangoIntegration
@@ -40,12 +41,93 @@ ALLOWED_HOSTS = [
 ]
 
 # Для подключения бэкенда кеширования
+# Двухуровневый кеш (core.cache): L1 в памяти воркера перед общим
+# L2. Общий бэкенд задаётся окружением (memcached, Redis, файлы),
+# без него L2 подменяет LocMemCache - для тестов и разработки.
+# Ключи поколений лент, сессии и пользователи сессий читаются только
+# из L2, чтобы их сдвиг, выход и смену пароля сразу видели все воркеры
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-    }
+        'BACKEND': 'core.cache.TwoLevelCache',
+        'LOCATION': 'shared',
+        'OPTIONS': {
+            'L1_MAX_ENTRIES': 1000,
+            'L1_TIMEOUT': 5,
+            'L1_BYPASS': [
+                'posts:gen:', 'posts:recent:', 'posts:missing:',
+                'posts:bloom:',
+                'django.contrib.sessions.cached_db', 'auth:user:',
+            ],
+        },
+    },
+    'shared': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    },
+}
+
+# Кеш целых страниц для анонимных читателей
+# (core.middleware.pages): срок жизни в секундах по имени маршрута
+PAGE_CACHE_TTLS = {
+    'posts:index': 30,
+    'posts:group_list': 60,
+    'posts:profile': 60,
+    'posts:post_detail': 120,
 }
 
+# Кеш скелетов страниц для вошедших пользователей: личные куски
+# страниц рисуются на каждый запрос через дырки core.holes
+SKELETON_CACHE_TTLS = PAGE_CACHE_TTLS
+
+# Промахи поиска пользователей, групп и постов из URL (posts.lookups)
+# помним столько секунд; фильтр Блума имён и слагов отсекает
+# несуществующие без запросов к базе
+NEGATIVE_LOOKUP_TIMEOUT = 10 * 60
+LOOKUP_BLOOM_FILTER = True
+# Новые имена дописываются в фильтр из журнала в кеше, целиком из
+# базы он перестраивается раз в столько секунд
+LOOKUP_BLOOM_REBUILD_AFTER = 60 * 60
+# Найденные пользователи и группы держим в кеше столько секунд
+LOOKUP_CACHE_TIMEOUT = 60 * 60
+
+# Срок жизни фрагментов лент (posts.cache): их сбрасывает
+# смена поколения, так что срок можно держать большим
+FEED_CACHE_TIMEOUT = 60 * 60
+
+# Режим пагинации лент постов (posts.paginators):
+# 'page' - нумерованные страницы через COUNT(*) и OFFSET,
+# 'estimate' - нумерованные страницы по оценке количества,
+# 'countless' - нумерованные страницы совсем без подсчёта,
+# 'cursor' - keyset-пагинация по (pub_date, id) с токенами ?cursor=
+POSTS_PAGINATION = {
+    'index': 'cursor',
+    'group_list': 'cursor',
+    'profile': 'cursor',
+    # лента подписок отдаёт обычный Page, курсор ей не подходит
+    'follow_index': 'countless',
+}
+
+# Движок ленты подписок (posts.feeds): 'join', 'timeline' или 'merge'
+FOLLOW_FEED_ENGINE = 'timeline'
+# Сколько свежих постов каждого автора держит в кеше движок 'merge'
+AUTHOR_RECENT_POSTS = 200
+# Посты авторов, у которых подписчиков больше этого числа, не
+# раскладываются по лентам при публикации, а читаются при просмотре
+TIMELINE_FANOUT_LIMIT = 1000
+# Сколько последних постов автора попадает в ленту при подписке
+TIMELINE_BACKFILL_SIZE = 200
+
+# Учёт SQL-запросов и поиск N+1 (core.middleware.queries): только
+# для разработки и стенда, на боевом сервере выключен вместе с DEBUG
+QUERY_INSPECTOR = DEBUG
+# Сколько одинаковых запросов из одного места кода ещё не N+1
+QUERY_INSPECTOR_THRESHOLD = 3
+# Карта идентичности запроса (core.identity): автор, группа и пост
+# по внешнему ключу берутся из уже загруженных в этом запросе
+IDENTITY_MAP = True
+
 # Имя view-функции, обрабатывающей ошибку 403, в константе
 CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
 
@@ -73,12 +155,26 @@ INSTALLED_APPS = [
     'sorl.thumbnail'
 ]
 
+# Сессии и пользователь сессии читаются из кеша, в базу идём только
+# при промахе (users.backends). ModelBackend остаётся для сессий,
+# открытых до кеша: в них записан его путь
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+AUTHENTICATION_BACKENDS = [
+    'users.backends.CachedModelBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+AUTH_USER_CACHE_TIMEOUT = 5 * 60
+
 MIDDLEWARE = [
+    'core.middleware.queries.QueryInspectorMiddleware',
+    'core.middleware.identity.IdentityMapMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'core.middleware.pages.AnonymousPageCacheMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.middleware.pages.SkeletonPageCacheMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -163,6 +259,37 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static/') # папка, в которой
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/2.2/howto/static-files/
 
+# Миниатюры картинок постов строит фоновый пул (posts.thumbnails),
+# до готовности шаблоны показывают заглушку. При THUMBNAIL_WORKERS=0
+# миниатюра строится сразу после коммита, в том же запросе: так
+# в тестах (manage.py test и pytest), чтобы поток пула не писал во
+# временный MEDIA_ROOT, пока тест его удаляет
+TESTING = sys.argv[1:2] == ['test'] or 'pytest' in sys.modules
+THUMBNAIL_WORKERS = int(os.getenv(
+    'THUMBNAIL_WORKERS', 0 if TESTING else 2
+))
+THUMBNAIL_PLACEHOLDER = 'img/thumbnail-placeholder.svg'
+# Варианты миниатюры для srcset по возрастанию ширины (geometry и
+# опции sorl), самый широкий - для src. С THUMBNAIL_WEBP каждый
+# вариант строится ещё и в WebP, если Pillow собран с его поддержкой.
+# После правки вариантов старые картинки достраивает build_thumbnails
+THUMBNAIL_VARIANTS = [
+    {'geometry': '480x170'},
+    {'geometry': '960x339'},
+]
+THUMBNAIL_WEBP = True
+THUMBNAIL_SIZES = '(max-width: 960px) 100vw, 960px'
+
+# Загрузки пишутся во временные файлы и обрываются после
+# IMAGE_MAX_BYTES; картинку больше IMAGE_MAX_PIXELS (не JPEG - больше
+# IMAGE_MAX_FULL_PIXELS) форма отклоняет до декодирования, остальные
+# ужимает до IMAGE_MAX_SIDE (posts.images)
+FILE_UPLOAD_HANDLERS = ['posts.images.LimitedUploadHandler']
+IMAGE_MAX_BYTES = 10 * 1024 * 1024
+IMAGE_MAX_PIXELS = 40 * 1000 * 1000
+IMAGE_MAX_FULL_PIXELS = 16 * 1000 * 1000
+IMAGE_MAX_SIDE = 2560
+
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 